@@ -0,0 +1,98 @@
+"""
+Load test for reactions: N threads smiling at a handful of hot posts, first
+with every request running its own write transaction (as the routes did
+before writer.py), then through the single writer. Both sides use the same
+mutation code and synchronous=FULL, so the difference is the coalescing.
+
+    python -m bench.reactions [--threads 16] [--reactions 4000] [--posts 5]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db_pool
+import migrations
+import mutations
+import writer
+
+EMOJIS = ["😊", "😂", "😍", "🎉", "👍"]
+
+
+def make_db(path, users, posts):
+    db = sqlite3.connect(path)
+    migrations.migrate(db)
+    db.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, 'x')",
+                   [(i, f"user{i}") for i in range(1, users + 1)])
+    db.executemany("INSERT INTO posts (id, user_id, content) VALUES (?, 1, ?)",
+                   [(i, f"post {i}") for i in range(1, posts + 1)])
+    db.commit()
+    db.close()
+
+
+def per_request(path, user_id, post_id, emoji):
+    with db_pool.connection(path) as db:
+        db.execute("PRAGMA synchronous = FULL")
+        db.execute("BEGIN IMMEDIATE")
+        mutations.smile(db, user_id, post_id, emoji)
+        db.commit()
+
+
+def single_writer(path, user_id, post_id, emoji):
+    writer.submit(path, mutations.smile, user_id, post_id, emoji)
+
+
+def run(label, smile, threads, reactions, posts):
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    make_db(path, reactions, posts)
+
+    errors = []
+    rng = random.Random(1)
+    # Every reaction comes from a different user, so each one is a real write.
+    jobs = [(user_id, rng.randint(1, posts), rng.choice(EMOJIS)) for user_id in range(1, reactions + 1)]
+    chunks = [jobs[i::threads] for i in range(threads)]
+
+    def worker(chunk):
+        for job in chunk:
+            try:
+                smile(path, *job)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    db = sqlite3.connect(path)
+    stored = db.execute("SELECT COUNT(*) FROM post_smiles").fetchone()[0]
+    db.close()
+    db_pool.discard(path)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    print(f"{label:<24} {reactions / elapsed:>8.0f} reactions/sec  ({elapsed:.2f}s, "
+          f"{stored} stored, {len(errors)} 'database is locked')")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--reactions", type=int, default=4000)
+    parser.add_argument("--posts", type=int, default=5)
+    args = parser.parse_args()
+
+    run("per-request transaction", per_request, args.threads, args.reactions, args.posts)
+    run("single writer", single_writer, args.threads, args.reactions, args.posts)
+
+
+if __name__ == "__main__":
+    main()
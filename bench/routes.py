@@ -0,0 +1,286 @@
+"""
+Latency benchmark for every page route against a seeded database (see
+bench/seed.py): the guest index, /feed, /top with every filter, profiles,
+single posts, search and smiling.
+
+By default each route is driven through Flask's test client, one request
+at a time, and the SQL statements each request runs on its connections are
+counted (smiles are written by the writer thread and not counted). With
+--http the routes are hit over HTTP from --concurrency threads, against a
+server started on the seeded database, or the one at --url (which must be
+using the same database and FLASK_SECRET_KEY).
+
+    python -m bench.routes bench.db [--requests 200] [--json out.json] [--compare baseline.json]
+    python -m bench.routes bench.db --http [--concurrency 16] [--url http://127.0.0.1:5000]
+
+The report gives p50/p95/p99 latency, queries per request and requests per
+second for each route. Save one run with --json and pass it to --compare on
+the next to see the change per route.
+"""
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.seed import EMOJIS, WORDS
+
+WARMUP = 5
+
+
+def cases(emojis):
+    """(name, method, path, logged in) for every benchmarked route."""
+    routes = [
+        ("index (guest)", "GET", lambda r, n: "/", False),
+        ("top (guest)", "GET", lambda r, n: "/top", False),
+        ("feed", "GET", lambda r, n: "/feed", True),
+        ("top", "GET", lambda r, n: "/top", True),
+        ("top combo", "GET", lambda r, n: "/top?filter=combo", True),
+        ("top hot", "GET", lambda r, n: "/top?sort=hot", True),
+    ]
+    routes += [(f"top {emoji}", "GET", lambda r, n, emoji=emoji: "/top?" + urllib.parse.urlencode({"filter": emoji}),
+                True) for emoji in emojis]
+    routes += [
+        ("user_profile", "GET", lambda r, n: f"/user/user{r.randint(1, n['users'])}", True),
+        ("view post", "GET", lambda r, n: f"/view/{r.randint(1, n['posts'])}", True),
+        ("search", "GET", lambda r, n: f"/search?q={r.choice(WORDS)}", True),
+        ("smile", "POST", lambda r, n: f"/smile/{r.randint(1, n['posts'])}", True),
+    ]
+    return routes
+
+
+def sizes(path):
+    db = sqlite3.connect(path)
+    counts = {table: db.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+              for table in ("users", "posts")}
+    counts["reactions"] = db.execute("SELECT COUNT(*) FROM post_smiles").fetchone()[0]
+    db.close()
+    return counts
+
+
+def summarize(name, latencies, queries, elapsed, errors):
+    latencies = sorted(latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "route": name,
+        "requests": len(latencies),
+        "p50_ms": round(percentiles[49] * 1000, 2),
+        "p95_ms": round(percentiles[94] * 1000, 2),
+        "p99_ms": round(percentiles[98] * 1000, 2),
+        "queries": round(statistics.mean(queries), 1) if queries else None,
+        "rps": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+    }
+
+
+def run_in_process(app, counts, requests, rng):
+    statements = []
+    app.config["SQL_TRACE"] = statements.append
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.testing = True
+    client = app.test_client()
+
+    results = []
+    for name, method, make_path, logged_in in cases(EMOJIS):
+        latencies, queries, errors = [], [], 0
+        elapsed = 0.0
+        for i in range(WARMUP + requests):
+            with client.session_transaction() as session:
+                session.clear()
+                if logged_in:
+                    session["user_id"] = rng.randint(1, counts["users"])
+            path = make_path(rng, counts)
+            statements.clear()
+            start = time.perf_counter()
+            if method == "POST":
+                response = client.post(path, data={"reaction": rng.choice(EMOJIS)},
+                                       headers={"Accept": "application/json"})
+            else:
+                response = client.get(path)
+            took = time.perf_counter() - start
+            if i < WARMUP:
+                continue
+            elapsed += took
+            latencies.append(took)
+            # Statements SQLite runs internally (triggers, FTS shadow tables) start with "--".
+            queries.append(sum(1 for sql in statements if not sql.startswith("--")))
+            if response.status_code >= 400 and response.status_code != 404:
+                errors += 1
+        results.append(summarize(name, latencies, queries, elapsed, errors))
+    return results
+
+
+class Sessions:
+    """Signed session cookies (and CSRF tokens) for any user, as the app would issue them."""
+
+    def __init__(self, app):
+        self.app = app
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie_name = app.config["SESSION_COOKIE_NAME"]
+
+    def cookie(self, user_id):
+        from flask import session
+        from flask_wtf.csrf import generate_csrf
+        with self.app.test_request_context():
+            if user_id:
+                session["user_id"] = user_id
+            token = generate_csrf()
+            return f"{self.cookie_name}={self.serializer.dumps(dict(session))}", token
+
+
+def http_request(base_url, method, path, cookie, token, emoji):
+    data = None
+    headers = {"Cookie": cookie}
+    if method == "POST":
+        data = urllib.parse.urlencode({"reaction": emoji, "csrf_token": token}).encode()
+        headers["Accept"] = "application/json"
+    request = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_http(app, counts, requests, rng, base_url, concurrency):
+    sessions = Sessions(app)
+    results = []
+    lock = threading.Lock()
+    for name, method, make_path, logged_in in cases(EMOJIS):
+        jobs = []
+        for _ in range(WARMUP + requests):
+            user_id = rng.randint(1, counts["users"]) if logged_in else None
+            jobs.append((make_path(rng, counts), *sessions.cookie(user_id), rng.choice(EMOJIS)))
+        latencies, errors = [], [0]
+
+        def send(job, record=True):
+            start = time.perf_counter()
+            status = http_request(base_url, method, *job)
+            took = time.perf_counter() - start
+            if record:
+                with lock:
+                    latencies.append(took)
+                    if status >= 400 and status != 404:
+                        errors[0] += 1
+
+        for job in jobs[:WARMUP]:
+            send(job, record=False)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, jobs[WARMUP:]))
+        results.append(summarize(name, latencies, [], time.perf_counter() - start, errors[0]))
+    return results
+
+
+def start_server(path, port):
+    server = subprocess.Popen([sys.executable, "-m", "bench.routes", path, "--serve", str(port)])
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/login").read()
+            return server, base_url
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("The benchmark server did not start.")
+
+
+def serve(app, path, port):
+    import logging
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app.config["DATABASE"] = path
+    app.run(port=port, threaded=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"{'route':<18} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'req/s':>8} {'errors':>7}")
+    for row in report["routes"]:
+        queries = "-" if row["queries"] is None else f"{row['queries']:.1f}"
+        print(f"{row['route']:<18} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+              f"{queries:>8} {row['rps']:>8.1f} {row['errors']:>7}")
+
+
+def print_comparison(baseline, report):
+    print(f"\nChange from {baseline.get('commit') or 'baseline'} (p50 / p95 / queries):")
+    before = {row["route"]: row for row in baseline["routes"]}
+    for row in report["routes"]:
+        old = before.get(row["route"])
+        if not old:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms"):
+            changes.append(f"{(row[key] - old[key]) / old[key] * 100:+6.0f}%" if old[key] else "     -")
+        if row["queries"] is not None and old["queries"] is not None:
+            changes.append(f"{row['queries'] - old['queries']:+.1f}")
+        print(f"{row['route']:<18} " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="database made by bench.seed")
+    parser.add_argument("--requests", type=int, default=200, help="per route")
+    parser.add_argument("--http", action="store_true")
+    parser.add_argument("--url", help="server to hit in --http mode instead of starting one")
+    parser.add_argument("--port", type=int, default=5057)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="report from an earlier --json run")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from main import app
+    if args.serve:
+        serve(app, args.path, args.serve)
+        return
+
+    app.config["DATABASE"] = args.path
+    counts = sizes(args.path)
+    rng = random.Random(args.seed)
+    report = {"commit": git_commit(), "mode": "http" if args.http else "in-process", "database": counts}
+    if args.http:
+        server = None
+        base_url = args.url
+        if not base_url:
+            server, base_url = start_server(args.path, args.port)
+        try:
+            report["concurrency"] = args.concurrency
+            report["routes"] = run_http(app, counts, args.requests, rng, base_url.rstrip("/"), args.concurrency)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+    else:
+        report["routes"] = run_in_process(app, counts, args.requests, rng)
+
+    print(f"{report['mode']} on {counts['users']} users, {counts['posts']} posts, "
+          f"{counts['reactions']} reactions, {args.requests} requests per route\n")
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Generates a synthetic social graph for benchmarks, writing straight into
+`users`, `posts`, `follows` and `post_smiles`, then rebuilding everything
+derived from them (reaction counters, posts.smiles, home timelines, the
+leaderboards and trending scores) the way the app would have.
+
+Popularity follows a power law: a few users write most posts and have most
+followers, a few posts get most reactions, and the first emojis are picked
+far more often than the last. Every user's password is "bench".
+
+    python -m bench.seed bench.db [--users 1000] [--posts 20000] [--reactions 200000]
+
+The full scale (--users 10000 --posts 1000000 --reactions 10000000) takes a
+while and several GB of disk, mostly for the home timelines.
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from werkzeug.security import generate_password_hash
+
+import leaderboards
+import migrations
+import timeline
+import trending
+
+# Same as main.ALLOWED_EMOJIS; importing main here would open the app's own database.
+EMOJIS = ['😊', '😂', '🥹', '🥰', '🤩', '🥳']
+WORDS = ("happy sunny lovely wonderful bright kind calm cozy garden coffee morning friends music "
+         "picnic puppy kitten beach sunset rainbow cookie smile laugh dance bloom hike").split()
+
+BATCH = 50000
+# Exponent of the Zipf weights; 1.0 is the classic "rank n gets 1/n".
+SKEW = 1.0
+HISTORY_DAYS = 90
+PASSWORD = "bench"
+
+
+class Zipf:
+    """Draws integers 1..n, rank r with probability proportional to 1 / r**SKEW."""
+
+    def __init__(self, n, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / rank ** SKEW for rank in range(1, n + 1)))
+        # Shuffled so popularity isn't tied to id order.
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+
+    def draw(self):
+        i = bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return self.ids[min(i, len(self.ids) - 1)]
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH))
+        if not batch:
+            return
+        yield batch
+
+
+def _insert(db, sql, rows):
+    for batch in _batches(rows):
+        db.executemany(sql, batch)
+    db.commit()
+
+
+def _step(label, started):
+    print(f"  {label:<28} {time.perf_counter() - started:7.1f}s")
+    return time.perf_counter()
+
+
+def seed(path, users, posts, reactions, seed=1):
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = WAL")
+    migrations.migrate(db)
+    db.execute("PRAGMA synchronous = OFF")
+    started = time.perf_counter()
+
+    password = generate_password_hash(PASSWORD)
+    _insert(db, "INSERT INTO users (id, username, password, profile_image) VALUES (?, ?, ?, ?)",
+            ((i, f"user{i}", password, rng.choice(EMOJIS)) for i in range(1, users + 1)))
+    started = _step(f"{users} users", started)
+
+    # Each user follows a power-law number of others, preferring popular ones.
+    popular = Zipf(users, rng)
+    follows = set()
+    for follower in range(1, users + 1):
+        for _ in range(min(int(rng.paretovariate(1.2) * 5), users - 1)):
+            followed = popular.draw()
+            if followed != follower:
+                follows.add((follower, followed))
+    follows = sorted(follows)
+    _insert(db, "INSERT INTO follows (follower_id, followed_id) VALUES (?, ?)", follows)
+    started = _step(f"{len(follows)} follows", started)
+
+    authors = Zipf(users, rng)
+    start = datetime.now(timezone.utc) - timedelta(days=HISTORY_DAYS)
+    step = HISTORY_DAYS * 86400 / max(posts, 1)
+    _insert(db, "INSERT INTO posts (id, user_id, content, timestamp) VALUES (?, ?, ?, ?)",
+            ((i, authors.draw(), " ".join(rng.choices(WORDS, k=rng.randint(4, 16))),
+              (start + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S"))
+             for i in range(1, posts + 1)))
+    started = _step(f"{posts} posts", started)
+
+    # Duplicate (user, post) pairs are dropped by the unique index, so the
+    # stored count comes out a little under `reactions`.
+    targets = Zipf(posts, rng)
+    emoji_weights = [1 / rank for rank in range(1, len(EMOJIS) + 1)]
+    _insert(db, "INSERT OR IGNORE INTO post_smiles (user_id, post_id, reaction_emoji) VALUES (?, ?, ?)",
+            ((rng.randint(1, users), targets.draw(), rng.choices(EMOJIS, emoji_weights)[0])
+             for _ in range(reactions)))
+    started = _step(f"{reactions} reactions", started)
+
+    db.execute("""
+        INSERT INTO post_reaction_counts (post_id, emoji, count)
+        SELECT post_id, reaction_emoji, COUNT(*) FROM post_smiles GROUP BY post_id, reaction_emoji
+    """)
+    db.execute("""
+        UPDATE posts SET smiles = totals.count
+        FROM (SELECT post_id, SUM(count) AS count FROM post_reaction_counts GROUP BY post_id) AS totals
+        WHERE posts.id = totals.post_id
+    """)
+    db.commit()
+    started = _step("reaction counters", started)
+
+    for follower, followed in follows:
+        timeline.backfill(db, follower, followed)
+    db.commit()
+    started = _step("home timelines", started)
+
+    leaderboards.refresh(db, EMOJIS)
+    trending.rebuild(db)
+    db.execute("ANALYZE")
+    db.commit()
+    _step("leaderboards, trending, ANALYZE", started)
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--reactions", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+    print(f"Seeding {args.path}:")
+    seed(args.path, args.users, args.posts, args.reactions, args.seed)
+
+
+if __name__ == "__main__":
+    main()
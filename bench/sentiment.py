@@ -0,0 +1,60 @@
+"""
+Compares sentiment-scoring throughput: the original per-post TextBlob code
+against the sentiment service, cold (every text new) and warm (every text
+already cached).
+
+    python -m bench.sentiment [--texts 2000]
+"""
+import argparse
+import random
+import time
+
+from textblob import TextBlob
+
+import sentiment
+
+WORDS = ("happy sunny great day friends lovely garden puppy smile coffee "
+         "morning walk kind grateful music dinner laugh family weekend").split()
+
+
+def original_analyze_sentiment(text):
+    # The implementation sentiment.py replaced, minus its debug print.
+    if not text:
+        return True
+    analysis = TextBlob(text)
+    analysis.sentiment.polarity
+    return analysis.sentiment.polarity >= -0.1
+
+
+def make_texts(count, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))) + f" #{i}" for i in range(count)]
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {count / elapsed:>10.0f} texts/sec  ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts)
+    # Start the pool and load the lexicon outside the timings.
+    sentiment.polarities(make_texts(sentiment.BATCH_CHUNK * sentiment.WORKERS, seed=3))
+    sentiment.polarity("warm up")
+
+    timed("original, one at a time", len(texts), lambda: [original_analyze_sentiment(t) for t in texts])
+    timed("service, one at a time (cold)", len(texts), lambda: [sentiment.is_positive(t) for t in texts])
+
+    texts = make_texts(args.texts, seed=2)
+    timed("service, batch (cold)", len(texts), lambda: sentiment.polarities(texts))
+    timed("service, batch (warm)", len(texts), lambda: sentiment.polarities(texts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures how long `import main` takes in a fresh interpreter, i.e. the cold
+start every gunicorn worker and CLI command pays, and lists the slowest
+imports reported by `python -X importtime`.
+
+    python -m bench.startup [--runs 5] [--top 15] [--max-ms 800]
+
+With --max-ms the script exits non-zero when the median import time is
+over budget, so it can guard against startup regressions.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once():
+    """Returns (wall-clock microseconds, importtime lines) for one cold import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import time; t = time.perf_counter(); import main; "
+                                                  "print(int((time.perf_counter() - t) * 1e6))"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True,
+    )
+    total = int(result.stdout.strip().splitlines()[-1])
+    lines = [line for line in result.stderr.splitlines() if line.startswith("import time:")]
+    return total, lines
+
+
+def slowest_imports(lines, top):
+    """
+    Parses importtime output into the `top` slowest (cumulative_us, module)
+    pairs one level below the top, i.e. what `main` (and `site`) import.
+    """
+    modules = []
+    for line in lines[1:]:  # first line is the header
+        _, cumulative_us, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            modules.append((int(cumulative_us), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    # The first run also creates/migrates the local database; leave it out.
+    import_once()
+    runs = [import_once() for _ in range(args.runs)]
+    median_ms = statistics.median(total for total, _ in runs) / 1000
+
+    print(f"import main: median {median_ms:.1f} ms over {args.runs} runs")
+    print("\nSlowest imports (cumulative):")
+    for us, name in slowest_imports(runs[-1][1], args.top):
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"\nFAIL: {median_ms:.1f} ms is over the {args.max_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Bulk export and import of users, posts, follows and reactions as NDJSON.
+
+Each line is one row: {"table": "posts", "row": {...}}. Tables are written
+in dependency order (users, posts, follows, post_smiles), with their ids
+kept, so a file can be restored into an empty database or merged into one
+whose ids and usernames don't overlap. Only the source rows travel.
+Everything derived from them is rebuilt on import: reaction counters,
+posts.smiles, home timelines, leaderboards, search indexes and upload
+reference counts. Deleted posts are left out, and the image files
+themselves stay in storage. Imported reactions don't count toward
+/top?sort=hot, because they aren't new.
+
+Both directions stream. Export reads BATCH rows at a time, and import
+buffers at most BATCH rows, so memory stays flat however big the file is.
+An import runs in one transaction:
+
+* it drops the secondary indexes of the tables it fills;
+* it inserts with executemany;
+* it recreates the indexes;
+* it rebuilds what depends on the new rows.
+
+A duplicate id or username rolls the whole import back. The transaction
+holds SQLite's write lock from start to finish, and the site's connections
+give up on a lock after five seconds (the busy_timeout), so stop the app
+while importing; otherwise its writes fail with "database is locked".
+
+    flask --app main export-ndjson backup.ndjson
+    flask --app main import-ndjson backup.ndjson [--check-sentiment]
+"""
+import json
+
+import leaderboards
+import sentiment
+import timeline
+import uploads
+
+BATCH = 5000
+
+# Exported columns per table, in import order.
+TABLES = {
+    "users": ("id", "username", "password", "bio", "profile_image"),
+    "posts": ("id", "user_id", "content", "image", "link", "timestamp"),
+    "follows": ("follower_id", "followed_id"),
+    "post_smiles": ("user_id", "post_id", "reaction_emoji"),
+}
+
+# Columns an import may leave out.
+DEFAULTS = {"bio": "", "profile_image": "", "image": "", "link": "", "timestamp": None}
+
+EXPORT_QUERIES = {
+    "users": "SELECT id, username, password, bio, profile_image FROM users ORDER BY id",
+    "posts": "SELECT id, user_id, content, image, link, timestamp FROM posts WHERE deleted_at IS NULL ORDER BY id",
+    "follows": "SELECT follower_id, followed_id FROM follows",
+    "post_smiles": """
+        SELECT user_id, post_id, reaction_emoji FROM post_smiles
+        WHERE post_id IN (SELECT id FROM posts WHERE deleted_at IS NULL)
+    """,
+}
+
+# Follows and reactions that point at users or posts the database doesn't
+# have (e.g. posts rejected by --check-sentiment) are skipped.
+INSERTS = {
+    "users": """
+        INSERT INTO users (id, username, password, bio, profile_image)
+        VALUES (:id, :username, :password, :bio, :profile_image)
+    """,
+    "posts": """
+        INSERT INTO posts (id, user_id, content, image, link, timestamp)
+        VALUES (:id, :user_id, :content, :image, :link, COALESCE(:timestamp, CURRENT_TIMESTAMP))
+    """,
+    "follows": """
+        INSERT OR IGNORE INTO follows (follower_id, followed_id)
+        SELECT :follower_id, :followed_id
+        WHERE EXISTS (SELECT 1 FROM users WHERE id = :follower_id)
+          AND EXISTS (SELECT 1 FROM users WHERE id = :followed_id)
+    """,
+    "post_smiles": """
+        INSERT INTO post_smiles (user_id, post_id, reaction_emoji)
+        SELECT :user_id, :post_id, :reaction_emoji
+        WHERE EXISTS (SELECT 1 FROM posts WHERE id = :post_id AND deleted_at IS NULL)
+    """,
+}
+
+# What each batch records for the rebuild at the end.
+SCRATCH = {
+    "posts": "INSERT INTO temp.imported_posts (id) VALUES (:id)",
+    "follows": """
+        INSERT OR IGNORE INTO temp.imported_follows (follower_id, followed_id)
+        SELECT :follower_id, :followed_id
+        WHERE EXISTS (SELECT 1 FROM follows WHERE follower_id = :follower_id AND followed_id = :followed_id)
+    """,
+    "post_smiles": "INSERT OR IGNORE INTO temp.reacted_posts (post_id) VALUES (:post_id)",
+}
+
+INDEXED_TABLES = ("users", "posts", "follows", "post_smiles", "home_timeline")
+
+
+class BadLine(ValueError):
+    pass
+
+
+def export(db, out):
+    """
+    Writes every table to the text stream `out`, from one consistent
+    snapshot. Returns {table: rows written}.
+    """
+    written = {}
+    db.execute("BEGIN")
+    try:
+        for table, columns in TABLES.items():
+            cursor = db.execute(EXPORT_QUERIES[table])
+            written[table] = 0
+            while True:
+                rows = cursor.fetchmany(BATCH)
+                if not rows:
+                    break
+                out.writelines(json.dumps({"table": table, "row": dict(zip(columns, row))}, ensure_ascii=False) + "\n"
+                               for row in rows)
+                written[table] += len(rows)
+    finally:
+        db.rollback()
+    return written
+
+
+def _parse(line, number):
+    try:
+        record = json.loads(line)
+        table, row = record["table"], record["row"]
+    except (ValueError, TypeError, KeyError):
+        raise BadLine(f"line {number}: expected {{\"table\": ..., \"row\": {{...}}}}")
+    if table not in TABLES:
+        raise BadLine(f"line {number}: unknown table {table!r}")
+    try:
+        return table, {column: row[column] if column in row else DEFAULTS[column] for column in TABLES[table]}
+    except (KeyError, TypeError):
+        missing = [column for column in TABLES[table] if column not in DEFAULTS and column not in row]
+        raise BadLine(f"line {number}: {table} row is missing {', '.join(missing) or 'its columns'}")
+
+
+def _drop_indexes(db):
+    """Drops the non-unique secondary indexes on INDEXED_TABLES. Returns the SQL to recreate them."""
+    placeholders = ",".join("?" * len(INDEXED_TABLES))
+    indexes = db.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%' AND tbl_name IN ({placeholders})
+    """, INDEXED_TABLES).fetchall()
+    for name, _ in indexes:
+        db.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def _flush(db, table, rows, check_sentiment):
+    """Inserts one batch. Returns (rows inserted, posts rejected)."""
+    rejected = 0
+    if table == "posts" and check_sentiment:
+        scores = sentiment.polarities([row["content"] for row in rows])
+        kept = [row for row, score in zip(rows, scores) if not row["content"] or score >= sentiment.THRESHOLD]
+        rejected = len(rows) - len(kept)
+        rows = kept
+
+    inserted = db.executemany(INSERTS[table], rows).rowcount if rows else 0
+    if table in SCRATCH and rows:
+        db.executemany(SCRATCH[table], rows)
+    for row in rows:
+        if table == "users":
+            uploads.acquire(db, row["profile_image"])
+        elif table == "posts":
+            uploads.acquire(db, row["image"])
+    return inserted, rejected
+
+
+def _rebuild_derived(db):
+    # Counters and posts.smiles for every post that got reactions.
+    db.execute("DELETE FROM post_reaction_counts WHERE post_id IN (SELECT post_id FROM temp.reacted_posts)")
+    db.execute("""
+        INSERT INTO post_reaction_counts (post_id, emoji, count)
+        SELECT post_id, reaction_emoji, COUNT(*) FROM post_smiles
+        WHERE post_id IN (SELECT post_id FROM temp.reacted_posts)
+        GROUP BY post_id, reaction_emoji
+    """)
+    db.execute("""
+        UPDATE posts SET smiles = (SELECT COALESCE(SUM(count), 0) FROM post_reaction_counts WHERE post_id = posts.id),
+            version = version + 1
+        WHERE id IN (SELECT post_id FROM temp.reacted_posts)
+    """)
+
+    # New posts reach their authors' existing followers, as push_post()
+    # does; imported follows are backfilled like any new follow.
+    db.execute("""
+        INSERT OR IGNORE INTO home_timeline (user_id, timestamp, post_id)
+        SELECT follows.follower_id, posts.timestamp, posts.id
+        FROM temp.imported_posts
+        JOIN posts ON posts.id = imported_posts.id
+        JOIN follows ON follows.followed_id = posts.user_id
+        WHERE NOT EXISTS (SELECT 1 FROM temp.imported_follows AS f
+                          WHERE f.follower_id = follows.follower_id AND f.followed_id = follows.followed_id)
+    """)
+    for follower_id, followed_id in db.execute("SELECT follower_id, followed_id FROM temp.imported_follows"):
+        timeline.backfill(db, follower_id, followed_id)
+
+
+def import_lines(db, lines, emojis, check_sentiment=False):
+    """
+    Loads the NDJSON `lines` (any iterable of strings, e.g. an open file).
+    With `check_sentiment`, posts the post form would reject as too
+    negative are skipped, along with their reactions.
+
+    Returns {table: rows inserted} plus "rejected_posts". Raises BadLine for
+    a malformed line and sqlite3.IntegrityError for a duplicate id or
+    username; either way nothing is imported.
+    """
+    counts = dict.fromkeys(TABLES, 0)
+    counts["rejected_posts"] = 0
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        recreate = _drop_indexes(db)
+        db.execute("CREATE TEMP TABLE imported_posts (id INTEGER PRIMARY KEY)")
+        db.execute("CREATE TEMP TABLE imported_follows (follower_id INTEGER, followed_id INTEGER, "
+                   "PRIMARY KEY (follower_id, followed_id)) WITHOUT ROWID")
+        db.execute("CREATE TEMP TABLE reacted_posts (post_id INTEGER PRIMARY KEY)")
+
+        # One buffer, flushed whenever the table changes, so rows always
+        # land after the rows they refer to.
+        table, batch = None, []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            row_table, row = _parse(line, number)
+            if batch and (row_table != table or len(batch) >= BATCH):
+                inserted, rejected = _flush(db, table, batch, check_sentiment)
+                counts[table] += inserted
+                counts["rejected_posts"] += rejected
+                batch = []
+            table = row_table
+            batch.append(row)
+        if batch:
+            inserted, rejected = _flush(db, table, batch, check_sentiment)
+            counts[table] += inserted
+            counts["rejected_posts"] += rejected
+
+        for sql in recreate:
+            db.execute(sql)
+        _rebuild_derived(db)
+        for scratch in ("imported_posts", "imported_follows", "reacted_posts"):
+            db.execute(f"DROP TABLE temp.{scratch}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    leaderboards.refresh(db, emojis)
+    db.execute("ANALYZE")
+    return counts
@@ -0,0 +1,201 @@
+"""
+Background garbage collection for deleted posts, uploads and free pages.
+
+Deleting a post only tombstones it (posts.deleted_at) and drops it from the
+home timelines and leaderboards, so the request stays short however many
+reactions the post has. purge_posts() then removes the reactions in chunks
+of PURGE_CHUNK rows, each in its own short transaction, and finally the post
+row itself, releasing its image. collect() runs that together with the
+upload sweep, link-preview cache pruning, and, every MAINTENANCE_INTERVAL,
+the orphaned-file scan and an incremental vacuum.
+"""
+import threading
+import time
+
+import db_pool
+import leaderboards
+import link_previews
+import reactions
+import trending
+import uploads
+
+COLLECT_INTERVAL = 60
+MAINTENANCE_INTERVAL = 24 * 3600
+PURGE_CHUNK = 500
+# Pause between chunks so queued writes get the lock in between.
+PURGE_PAUSE = 0.01
+VACUUM_PAGES = 2000
+
+purged_posts = 0
+purged_reactions = 0
+swept_uploads = 0
+swept_orphans = 0
+vacuumed_pages = 0
+last_collected = None
+last_maintained = None
+
+
+def _purge_chunk(db, chunk):
+    """
+    Deletes up to `chunk` reactions of the oldest tombstoned post, or the post
+    itself once none are left. Returns (posts, reactions) deleted, or None if
+    there is nothing to purge.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        post = db.execute("""
+            SELECT id, image FROM posts WHERE deleted_at IS NOT NULL ORDER BY deleted_at LIMIT 1
+        """).fetchone()
+        if not post:
+            db.rollback()
+            return None
+
+        post_id, image = post
+        smiles = db.execute("""
+            DELETE FROM post_smiles WHERE rowid IN (SELECT rowid FROM post_smiles WHERE post_id = ? LIMIT ?)
+        """, (post_id, chunk)).rowcount
+        posts = 0
+        if smiles < chunk:
+            reactions.delete_post_counts(db, post_id)
+            leaderboards.remove_post(db, post_id)
+            trending.remove_post(db, post_id)
+            db.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+            uploads.release(db, image)
+            posts = 1
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return posts, smiles
+
+
+def purge_posts(db, chunk=PURGE_CHUNK, pause=PURGE_PAUSE):
+    """Purges every tombstoned post. Returns (posts, reactions) deleted."""
+    global purged_posts, purged_reactions
+    total_posts = total_reactions = 0
+    while True:
+        done = _purge_chunk(db, chunk)
+        if done is None:
+            return total_posts, total_reactions
+        total_posts += done[0]
+        total_reactions += done[1]
+        purged_posts += done[0]
+        purged_reactions += done[1]
+        time.sleep(pause)
+
+
+def sweep_uploads(db, storage):
+    """Runs uploads.sweep() until it runs dry. Returns how many blobs it deleted."""
+    global swept_uploads
+    total = 0
+    while True:
+        swept = uploads.sweep(db, storage)
+        total += swept
+        swept_uploads += swept
+        if swept < uploads.SWEEP_BATCH:
+            return total
+
+
+def vacuum(db, pages=VACUUM_PAGES):
+    """
+    Returns up to `pages` free pages to the filesystem. Does nothing unless
+    the database uses incremental auto-vacuum (see full_vacuum()).
+    """
+    global vacuumed_pages
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    free = db.execute("PRAGMA freelist_count").fetchone()[0]
+    # PRAGMA does not accept bound parameters; pages is always an int.
+    db.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    freed = free - db.execute("PRAGMA freelist_count").fetchone()[0]
+    vacuumed_pages += freed
+    return freed
+
+
+def full_vacuum(db):
+    """
+    Rebuilds the database file, switching it to incremental auto-vacuum.
+    Blocks every writer while it runs, so only use it during maintenance.
+    """
+    db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    db.execute("VACUUM")
+
+
+def _sweep_orphans(db, storage):
+    global swept_orphans
+    swept = uploads.sweep_orphans(db, storage)
+    swept_orphans += swept
+    return swept
+
+
+def collect(db, storage, maintenance=False):
+    """One collection pass. Returns a dict of what it removed."""
+    global last_collected, last_maintained
+    posts, reactions = purge_posts(db)
+    done = {
+        "posts": posts,
+        "reactions": reactions,
+        "uploads": sweep_uploads(db, storage),
+        "link_previews": link_previews.prune(db),
+    }
+    db.commit()
+    if maintenance:
+        done["orphans"] = _sweep_orphans(db, storage)
+        done["vacuumed_pages"] = vacuum(db)
+        last_maintained = time.time()
+    last_collected = time.time()
+    return done
+
+
+def backlog(db):
+    """What is waiting to be collected."""
+    tombstoned = db.execute("SELECT COUNT(*) FROM posts WHERE deleted_at IS NOT NULL").fetchone()[0]
+    reactions = db.execute("""
+        SELECT COUNT(*) FROM post_smiles
+        WHERE post_id IN (SELECT id FROM posts WHERE deleted_at IS NOT NULL)
+    """).fetchone()[0]
+    unused_uploads = db.execute("SELECT COUNT(*) FROM blobs WHERE refs <= 0").fetchone()[0]
+    return {
+        "tombstoned_posts": tombstoned,
+        "reactions": reactions,
+        "unused_uploads": unused_uploads,
+        "free_pages": db.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+
+
+def stats():
+    return {
+        "purged_posts": purged_posts,
+        "purged_reactions": purged_reactions,
+        "swept_uploads": swept_uploads,
+        "swept_orphans": swept_orphans,
+        "vacuumed_pages": vacuumed_pages,
+        "last_collected": last_collected,
+        "last_maintained": last_maintained,
+    }
+
+
+_collector = None
+
+
+def start_collector(db_path, storage, interval=COLLECT_INTERVAL):
+    """
+    Starts the background thread that runs collect() every `interval`
+    seconds, with maintenance once a day. Safe to call more than once.
+    """
+    global _collector
+    if _collector is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            maintenance = last_maintained is None or time.time() - last_maintained > MAINTENANCE_INTERVAL
+            try:
+                with db_pool.connection(db_path) as db:
+                    collect(db, storage, maintenance)
+            except Exception as e:
+                print(f"Error collecting garbage: {e}")
+
+    _collector = threading.Thread(target=run, name="garbage-collector", daemon=True)
+    _collector.start()
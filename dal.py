@@ -0,0 +1,311 @@
+"""
+Data-access layer for users, follows, reactions and feeds.
+
+These queries have two implementations with the same methods and results:
+SQLiteDAL, which the app runs on (it reuses reactions.py and timeline.py),
+and PostgresDAL. Every method takes the connection first and runs inside
+the caller's transaction. get(db) picks the implementation that matches a
+connection.
+
+PostgresDAL is parity-tested only: nothing in the app opens a PostgreSQL
+connection, so there is no configuration that selects it and no server-side
+pool. The rest of the app (leaderboards, search, HTTP caching, the writer
+queue, upload reference counts, migrations) is still SQLite-only and would
+have to move first. Until then `flask --app main check-dal-parity` runs the
+same scenario through both implementations and reports any difference.
+
+PostgreSQL needs `pip install "psycopg[binary]"`, imported only when a
+PostgreSQL connection is opened.
+"""
+import sqlite3
+
+import reactions
+import timeline
+from pagination import keyset_page
+
+
+class UsernameTaken(Exception):
+    pass
+
+
+class SQLiteDAL:
+    def users_by_id(self, db, user_ids):
+        """Returns the users with the given ids as dicts, in no particular order."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        placeholders = ",".join("?" * len(user_ids))
+        return [dict(row) for row in db.execute(f"SELECT * FROM users WHERE id IN ({placeholders})", user_ids)]
+
+    def user_by_username(self, db, username):
+        row = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row else None
+
+    def create_user(self, db, username, password_hash, profile_image):
+        """Returns the new user's id. Raises UsernameTaken."""
+        try:
+            cur = db.execute("INSERT INTO users (username, password, profile_image) VALUES (?, ?, ?)",
+                             (username, password_hash, profile_image))
+        except sqlite3.IntegrityError:
+            raise UsernameTaken(username)
+        return cur.lastrowid
+
+    def set_password(self, db, user_id, password_hash):
+        db.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+
+    def create_post(self, db, user_id, content, image, link):
+        """Stores a post, fans it out to the author's followers and returns its id."""
+        cur = db.execute("INSERT INTO posts (user_id, content, image, link) VALUES (?, ?, ?, ?)",
+                         (user_id, content, image, link))
+        timeline.push_post(db, cur.lastrowid, user_id)
+        return cur.lastrowid
+
+    def follow(self, db, follower_id, followed_id):
+        db.execute("INSERT OR IGNORE INTO follows (follower_id, followed_id) VALUES (?, ?)",
+                   (follower_id, followed_id))
+        timeline.backfill(db, follower_id, followed_id)
+
+    def unfollow(self, db, follower_id, followed_id):
+        db.execute("DELETE FROM follows WHERE follower_id = ? AND followed_id = ?",
+                   (follower_id, followed_id))
+        timeline.prune(db, follower_id, followed_id)
+
+    def is_following(self, db, follower_id, followed_id):
+        return db.execute("SELECT 1 FROM follows WHERE follower_id = ? AND followed_id = ?",
+                          (follower_id, followed_id)).fetchone() is not None
+
+    def record_reaction(self, db, user_id, post_id, emoji):
+        """Returns the emoji this reaction replaced, or None if it is new."""
+        return reactions.record_reaction(db, user_id, post_id, emoji)
+
+    def reaction_counts(self, db, post_ids, emojis):
+        return reactions.reaction_counts(db, post_ids, emojis)
+
+    def posts_by_id(self, db, post_ids):
+        """Returns the live (not deleted) posts with the given ids, in no particular order."""
+        post_ids = list(post_ids)
+        if not post_ids:
+            return []
+        placeholders = ",".join("?" * len(post_ids))
+        return db.execute(f"""
+            SELECT id, user_id, content, image, link, smiles, timestamp, version FROM posts
+            WHERE id IN ({placeholders}) AND deleted_at IS NULL
+        """, post_ids).fetchall()
+
+    def user_reactions(self, db, user_id, post_ids):
+        """Returns {post_id: emoji} for the posts among `post_ids` that `user_id` reacted to."""
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+        placeholders = ",".join("?" * len(post_ids))
+        rows = db.execute(f"""
+            SELECT post_id, reaction_emoji FROM post_smiles WHERE user_id = ? AND post_id IN ({placeholders})
+        """, [user_id, *post_ids])
+        return {row[0]: row[1] for row in rows}
+
+    def timeline_page(self, db, user_id, before=None, limit=20):
+        """Returns (rows, next_cursor); each row's `timeline_id` is a post id, newest first."""
+        return timeline.page(db, user_id, before, limit)
+
+    def discovery_feed(self, db, limit=50):
+        """Returns the ids of the newest posts."""
+        rows = db.execute("""
+            SELECT id FROM posts WHERE deleted_at IS NULL ORDER BY timestamp DESC LIMIT ?
+        """, (limit,))
+        return [row[0] for row in rows]
+
+
+class PostgresDAL:
+    # The tables these queries touch, mirroring migrations 1-4, 8 and 12.
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        bio TEXT DEFAULT '',
+        profile_image TEXT DEFAULT ''
+    );
+    CREATE TABLE IF NOT EXISTS posts (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT REFERENCES users (id),
+        content TEXT NOT NULL,
+        image TEXT DEFAULT '',
+        link TEXT DEFAULT '',
+        smiles INTEGER DEFAULT 0,
+        timestamp TIMESTAMP(0) NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        version INTEGER NOT NULL DEFAULT 0,
+        deleted_at DOUBLE PRECISION
+    );
+    CREATE INDEX IF NOT EXISTS idx_posts_user_timestamp ON posts (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON posts (timestamp);
+    CREATE TABLE IF NOT EXISTS follows (
+        follower_id BIGINT NOT NULL,
+        followed_id BIGINT NOT NULL,
+        PRIMARY KEY (follower_id, followed_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_follows_followed ON follows (followed_id);
+    CREATE TABLE IF NOT EXISTS post_smiles (
+        user_id BIGINT NOT NULL,
+        post_id BIGINT NOT NULL,
+        reaction_emoji TEXT NOT NULL,
+        PRIMARY KEY (user_id, post_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_post_smiles_post_emoji ON post_smiles (post_id, reaction_emoji);
+    CREATE TABLE IF NOT EXISTS post_reaction_counts (
+        post_id BIGINT NOT NULL,
+        emoji TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (post_id, emoji)
+    );
+    CREATE TABLE IF NOT EXISTS home_timeline (
+        user_id BIGINT NOT NULL,
+        timestamp TIMESTAMP(0) NOT NULL,
+        post_id BIGINT NOT NULL,
+        PRIMARY KEY (user_id, timestamp, post_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_home_timeline_post ON home_timeline (post_id);
+    """
+
+    # Text timestamps, as SQLite returns them, for templates and cursors.
+    POST_COLUMNS = """posts.id, posts.user_id, posts.content, posts.image, posts.link, posts.smiles,
+        to_char(posts.timestamp, 'YYYY-MM-DD HH24:MI:SS') AS timestamp, posts.version"""
+
+    def create_schema(self, db):
+        db.execute(self.SCHEMA)
+
+    def users_by_id(self, db, user_ids):
+        return db.execute("SELECT * FROM users WHERE id = ANY(%s)", (list(user_ids),)).fetchall()
+
+    def user_by_username(self, db, username):
+        return db.execute("SELECT * FROM users WHERE username = %s", (username,)).fetchone()
+
+    def create_user(self, db, username, password_hash, profile_image):
+        row = db.execute("""
+            INSERT INTO users (username, password, profile_image) VALUES (%s, %s, %s)
+            ON CONFLICT (username) DO NOTHING
+            RETURNING id
+        """, (username, password_hash, profile_image)).fetchone()
+        if row is None:
+            raise UsernameTaken(username)
+        return row["id"]
+
+    def set_password(self, db, user_id, password_hash):
+        db.execute("UPDATE users SET password = %s WHERE id = %s", (password_hash, user_id))
+
+    def create_post(self, db, user_id, content, image, link):
+        post = db.execute("""
+            INSERT INTO posts (user_id, content, image, link) VALUES (%s, %s, %s, %s)
+            RETURNING id, timestamp
+        """, (user_id, content, image, link)).fetchone()
+        db.execute("""
+            INSERT INTO home_timeline (user_id, timestamp, post_id)
+            SELECT follower_id, %s, %s FROM follows WHERE followed_id = %s
+            ON CONFLICT DO NOTHING
+        """, (post["timestamp"], post["id"], user_id))
+        return post["id"]
+
+    def follow(self, db, follower_id, followed_id):
+        db.execute("INSERT INTO follows (follower_id, followed_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                   (follower_id, followed_id))
+        db.execute("""
+            INSERT INTO home_timeline (user_id, timestamp, post_id)
+            SELECT %s, timestamp, id FROM posts
+            WHERE user_id = %s AND deleted_at IS NULL
+            ORDER BY timestamp DESC
+            LIMIT %s
+            ON CONFLICT DO NOTHING
+        """, (follower_id, followed_id, timeline.BACKFILL_LIMIT))
+
+    def unfollow(self, db, follower_id, followed_id):
+        db.execute("DELETE FROM follows WHERE follower_id = %s AND followed_id = %s", (follower_id, followed_id))
+        db.execute("""
+            DELETE FROM home_timeline
+            WHERE user_id = %s AND post_id IN (SELECT id FROM posts WHERE user_id = %s)
+        """, (follower_id, followed_id))
+
+    def is_following(self, db, follower_id, followed_id):
+        return db.execute("SELECT 1 FROM follows WHERE follower_id = %s AND followed_id = %s",
+                          (follower_id, followed_id)).fetchone() is not None
+
+    def _bump(self, db, post_id, emoji, delta):
+        db.execute("""
+            INSERT INTO post_reaction_counts (post_id, emoji, count) VALUES (%s, %s, %s)
+            ON CONFLICT (post_id, emoji) DO UPDATE SET count = post_reaction_counts.count + EXCLUDED.count
+        """, (post_id, emoji, delta))
+        if delta < 0:
+            db.execute("DELETE FROM post_reaction_counts WHERE post_id = %s AND emoji = %s AND count <= 0",
+                       (post_id, emoji))
+
+    def record_reaction(self, db, user_id, post_id, emoji):
+        # Several app servers write at once here, so rather than read-then-
+        # write, claim the row first and only read the old emoji once the
+        # row is known to exist and is locked.
+        inserted = db.execute("""
+            INSERT INTO post_smiles (user_id, post_id, reaction_emoji) VALUES (%s, %s, %s)
+            ON CONFLICT (user_id, post_id) DO NOTHING
+            RETURNING 1
+        """, (user_id, post_id, emoji)).fetchone()
+        if inserted:
+            db.execute("UPDATE posts SET smiles = smiles + 1 WHERE id = %s", (post_id,))
+            self._bump(db, post_id, emoji, 1)
+            return None
+
+        previous = db.execute("""
+            SELECT reaction_emoji FROM post_smiles WHERE user_id = %s AND post_id = %s FOR UPDATE
+        """, (user_id, post_id)).fetchone()["reaction_emoji"]
+        if previous != emoji:
+            db.execute("UPDATE post_smiles SET reaction_emoji = %s WHERE user_id = %s AND post_id = %s",
+                       (emoji, user_id, post_id))
+            self._bump(db, post_id, previous, -1)
+            self._bump(db, post_id, emoji, 1)
+        return previous
+
+    def reaction_counts(self, db, post_ids, emojis):
+        counts = {post_id: {emoji: 0 for emoji in emojis} for post_id in post_ids}
+        if not counts:
+            return counts
+        rows = db.execute("""
+            SELECT post_id, emoji, count FROM (
+                SELECT post_id, emoji, count,
+                    ROW_NUMBER() OVER (PARTITION BY post_id ORDER BY count DESC, emoji) AS place
+                FROM post_reaction_counts
+                WHERE post_id = ANY(%s) AND emoji = ANY(%s)
+            ) AS ranked
+            WHERE place <= %s
+        """, (list(counts), list(emojis), reactions.TOP_REACTIONS)).fetchall()
+        for row in rows:
+            counts[row["post_id"]][row["emoji"]] = row["count"]
+        return counts
+
+    def posts_by_id(self, db, post_ids):
+        return db.execute(f"""
+            SELECT {self.POST_COLUMNS} FROM posts WHERE posts.id = ANY(%s) AND posts.deleted_at IS NULL
+        """, (list(post_ids),)).fetchall()
+
+    def user_reactions(self, db, user_id, post_ids):
+        rows = db.execute("""
+            SELECT post_id, reaction_emoji FROM post_smiles WHERE user_id = %s AND post_id = ANY(%s)
+        """, (user_id, list(post_ids))).fetchall()
+        return {row["post_id"]: row["reaction_emoji"] for row in rows}
+
+    def timeline_page(self, db, user_id, before=None, limit=20):
+        return keyset_page(db, """
+            SELECT timestamp, post_id AS timeline_id, to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') AS timeline_ts
+            FROM home_timeline
+            WHERE user_id = %s
+        """, (user_id,), ("timestamp", "timeline_id"), before, limit, placeholder="%s")
+
+    def discovery_feed(self, db, limit=50):
+        rows = db.execute("""
+            SELECT id FROM posts WHERE deleted_at IS NULL ORDER BY timestamp DESC LIMIT %s
+        """, (limit,)).fetchall()
+        return [row["id"] for row in rows]
+
+
+SQLITE = SQLiteDAL()
+POSTGRES = PostgresDAL()
+
+
+def get(db):
+    """The implementation for connection `db`."""
+    return SQLITE if isinstance(db, sqlite3.Connection) else POSTGRES
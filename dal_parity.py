@@ -0,0 +1,112 @@
+"""
+Parity check between the SQLite and PostgreSQL data-access layers.
+
+Plays the same scripted scenario (sign-ups, follows, posts, reactions that
+change and repeat, feed pages) through SQLiteDAL on a scratch database and
+PostgresDAL in a throwaway schema, and reports every step whose results
+differ. Timestamps are compared by order only, since the two databases
+store them differently.
+
+Run it with `flask --app main check-dal-parity postgresql://...`.
+"""
+import os
+import sqlite3
+import tempfile
+import uuid
+
+import dal
+import migrations
+
+EMOJIS = ("😊", "😂", "😍", "🔥")
+
+
+def _posts(impl, db, post_ids, viewer_id):
+    """The posts with `post_ids` as hydration.load() would see them, in that order."""
+    rows = {row["id"]: row for row in impl.posts_by_id(db, post_ids)}
+    reactions = impl.user_reactions(db, viewer_id, post_ids)
+    return [(rows[post_id]["id"], rows[post_id]["user_id"], rows[post_id]["content"], reactions.get(post_id))
+            for post_id in post_ids if post_id in rows]
+
+
+def _scenario(impl, db):
+    """Yields (step, result) pairs; results must match across implementations."""
+    ids = {}
+    for name in ("alice", "bob", "carol"):
+        ids[name] = impl.create_user(db, name, "x", "😊")
+    yield "create users", sorted(ids.values())
+    try:
+        impl.create_user(db, "bob", "x", "😊")
+        yield "duplicate username", "accepted"
+    except dal.UsernameTaken:
+        yield "duplicate username", "rejected"
+    yield "user by username", dict(impl.user_by_username(db, "carol") or {}).get("id")
+    yield "missing user", impl.user_by_username(db, "nobody")
+    yield "users by id", sorted(user["username"] for user in impl.users_by_id(db, [ids["alice"], ids["bob"], 999]))
+
+    impl.set_password(db, ids["carol"], "y")
+    yield "set password", [user["password"] for user in impl.users_by_id(db, [ids["carol"]])]
+
+    impl.follow(db, ids["alice"], ids["bob"])
+    impl.follow(db, ids["alice"], ids["bob"])
+    yield "is following", (impl.is_following(db, ids["alice"], ids["bob"]), impl.is_following(db, ids["bob"], ids["alice"]))
+    posts = [impl.create_post(db, ids[author], f"post {i}", "", "")
+             for i, author in enumerate(["bob", "carol", "bob", "bob", "alice"])]
+    yield "create posts", posts
+    impl.follow(db, ids["alice"], ids["carol"])
+
+    reactions = [("alice", 0, "😊"), ("bob", 0, "😂"), ("carol", 0, "😂"), ("alice", 0, "😂"),
+                 ("alice", 0, "😂"), ("carol", 1, "🔥"), ("bob", 1, "😍"), ("carol", 1, "😍"),
+                 ("alice", 1, "😊"), ("alice", 1, "🔥"), ("bob", 2, "❤️")]
+    for user, post, emoji in reactions:
+        yield f"{user} reacts {emoji} to post {post}", impl.record_reaction(db, ids[user], posts[post], emoji)
+    yield "reaction counts", impl.reaction_counts(db, posts + [999], EMOJIS)
+    yield "smiles", sorted((row["id"], row["smiles"]) for row in impl.posts_by_id(db, posts + [999]))
+    yield "user reactions", impl.user_reactions(db, ids["alice"], posts + [999])
+
+    cursor = None
+    for page in range(3):
+        rows, cursor = impl.timeline_page(db, ids["alice"], cursor, 2)
+        page_ids = [row["timeline_id"] for row in rows]
+        yield f"timeline page {page}", (_posts(impl, db, page_ids, ids["alice"]), cursor is not None)
+        if cursor is None:
+            break
+    yield "discovery feed", sorted(_posts(impl, db, impl.discovery_feed(db, 10), ids["bob"]))
+
+    impl.unfollow(db, ids["alice"], ids["bob"])
+    yield "is following after unfollow", impl.is_following(db, ids["alice"], ids["bob"])
+    rows, cursor = impl.timeline_page(db, ids["alice"], None, 10)
+    yield "timeline after unfollow", ([row["timeline_id"] for row in rows], cursor is not None)
+
+
+def check(postgres_url):
+    """
+    Returns a list of (step, sqlite result, postgres result) for every step
+    where the implementations disagree.
+    """
+    import psycopg
+    from psycopg.rows import dict_row
+
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        db = sqlite3.connect(db_path)
+        db.row_factory = sqlite3.Row
+        migrations.migrate(db)
+        expected = list(_scenario(dal.SQLITE, db))
+        db.close()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    schema = f"chrpi_parity_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(postgres_url, row_factory=dict_row, autocommit=True) as pg:
+        pg.execute(f"CREATE SCHEMA {schema}")
+        try:
+            pg.execute(f"SET search_path TO {schema}")
+            dal.POSTGRES.create_schema(pg)
+            actual = list(_scenario(dal.POSTGRES, pg))
+        finally:
+            pg.execute(f"DROP SCHEMA {schema} CASCADE")
+
+    return [(step, want, got) for (step, want), (_, got) in zip(expected, actual) if want != got]
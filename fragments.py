@@ -0,0 +1,91 @@
+"""
+Cache of rendered post cards.
+
+A card is rendered once per (template, post id, post version) and the HTML is
+shared by every viewer. `posts.version` is bumped whenever something on the
+card changes (a reaction, a link preview arriving); author and image
+derivative changes are part of the key as well. The per-viewer bits are
+overlaid on the shared HTML:
+
+* the CSRF token, rendered as CSRF_MARK;
+* the delete form, rendered between OWNER_START and OWNER_END and cut out
+  for everyone but the author;
+* the viewer's own reaction, marked by adding `reaction-btn-active`.
+
+Post content is autoescaped, so none of the markers can come from a user.
+"""
+import secrets
+import threading
+from collections import OrderedDict
+
+from flask import render_template
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+CACHE_SIZE = 5000
+
+CSRF_MARK = f"csrf-{secrets.token_hex(16)}"
+OWNER_START = "<!--owner-->"
+OWNER_END = "<!--/owner-->"
+REACTION_BUTTON = 'class="reaction-btn" data-reaction="{}"'
+ACTIVE_REACTION_BUTTON = 'class="reaction-btn reaction-btn-active" data-reaction="{}"'
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def _key(template, post):
+    return (template, post["id"], post["version"], post["username"], post["profile_image"],
+            tuple(post.get("image_sources", ())))
+
+
+def _shared_html(template, post, context):
+    global hits, misses
+    key = _key(template, post)
+    with _lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+            hits += 1
+            return html
+        misses += 1
+
+    html = render_template(template, post=post, user=None, csrf_token=lambda: CSRF_MARK, **context)
+    with _lock:
+        _cache[key] = html
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return html
+
+
+def _overlay(html, post, viewer):
+    if CSRF_MARK in html:
+        html = html.replace(CSRF_MARK, generate_csrf())
+
+    start = html.find(OWNER_START)
+    if start != -1:
+        end = html.find(OWNER_END, start) + len(OWNER_END)
+        if viewer and viewer["id"] == post["user_id"]:
+            html = html[:start] + html[start + len(OWNER_START):end - len(OWNER_END)] + html[end:]
+        else:
+            html = html[:start] + html[end:]
+
+    reaction = post.get("user_reaction")
+    if reaction:
+        html = html.replace(REACTION_BUTTON.format(reaction), ACTIVE_REACTION_BUTTON.format(reaction), 1)
+    return html
+
+
+def render_cards(template, posts, viewer, **context):
+    """
+    Returns the rendered `template` card for each post as Markup, as seen by
+    `viewer` (the current user row, or None).
+    """
+    return [Markup(_overlay(_shared_html(template, post, context), post, viewer)) for post in posts]
+
+
+def stats():
+    with _lock:
+        return {"size": len(_cache), "hits": hits, "misses": misses}
@@ -0,0 +1,14 @@
+"""
+Gunicorn settings, picked up when gunicorn is started from this directory:
+
+    gunicorn main:app
+
+Every page with post cards keeps a /live/reactions stream open (for up to
+live.STREAM_LIFETIME seconds at a time), so the workers are threaded: an
+open stream holds one thread rather than a whole sync worker.
+"""
+import os
+
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
@@ -0,0 +1,59 @@
+"""
+HTTP caching for post-list pages and uploads.
+
+`content_version.version` is bumped by triggers (migration 10) on every
+write that can change what a post list shows: posts, follows, profile
+fields, image derivatives and leaderboard rebuilds. The pages use it for a
+weak ETag, so a browser that already has the current page gets a 304
+without it being rendered. Guest copies of index and /top are kept in a
+full-page cache keyed by URL and served for as long as the version stands.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+
+GUEST_CACHE_SIZE = 500
+TOKEN_BUCKET = 1800
+
+_guest_pages = OrderedDict()  # full path -> (version, body, mimetype)
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def content_version(db):
+    return db.execute("SELECT version FROM content_version WHERE id = 1").fetchone()[0]
+
+
+def etag(version, viewer_id):
+    # Pages embed CSRF tokens, which expire after an hour; the time bucket
+    # keeps a revalidated page from outliving its token.
+    return f"{version}-{viewer_id or 0}-{int(time.time()) // TOKEN_BUCKET}"
+
+
+def guest_page(path, version):
+    """Returns the cached (body, mimetype) for `path` at `version`, or None."""
+    global hits, misses
+    with _lock:
+        entry = _guest_pages.get(path)
+        if entry is None or entry[0] != version:
+            misses += 1
+            return None
+        _guest_pages.move_to_end(path)
+        hits += 1
+        return entry[1], entry[2]
+
+
+def store_guest_page(path, version, body, mimetype):
+    with _lock:
+        _guest_pages[path] = (version, body, mimetype)
+        _guest_pages.move_to_end(path)
+        while len(_guest_pages) > GUEST_CACHE_SIZE:
+            _guest_pages.popitem(last=False)
+
+
+def stats():
+    with _lock:
+        return {"size": len(_guest_pages), "hits": hits, "misses": misses}
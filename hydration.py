@@ -0,0 +1,72 @@
+"""
+Batched post hydration for every post list.
+
+Routes only select the ids of the posts on a page (plus whatever their
+cursor needs). load() then fetches everything the post cards show for the
+whole page in a fixed number of set-based queries, however many posts
+there are:
+
+* the post rows, by id;
+* the authors, from the user cache (one query for the misses);
+* the viewer's own reaction to each post;
+* the per-emoji counts, from the materialized counters;
+* the srcsets of any resized image derivatives.
+"""
+import dal
+import images
+import users
+
+
+class Post:
+    """One hydrated post. Supports post["field"] as well as post.field, for templates and the card cache."""
+
+    __slots__ = ("id", "user_id", "content", "image", "link", "smiles", "timestamp", "version",
+                 "username", "profile_image", "user_reaction", "reaction_counts_dict", "image_sources")
+
+    def __init__(self, row, author, user_reaction, reaction_counts, image_sources):
+        self.id = row["id"]
+        self.user_id = row["user_id"]
+        self.content = row["content"]
+        self.image = row["image"]
+        self.link = row["link"]
+        self.smiles = row["smiles"]
+        self.timestamp = row["timestamp"]
+        self.version = row["version"]
+        self.username = author["username"]
+        self.profile_image = author["profile_image"]
+        self.user_reaction = user_reaction
+        self.reaction_counts_dict = reaction_counts
+        self.image_sources = image_sources
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+
+def load(db, post_ids, viewer_id=None, emojis=()):
+    """
+    Returns the posts with `post_ids` as Post objects, in the same order.
+    Deleted posts and posts whose author no longer exists are left out.
+    The viewer's reactions are only looked up with a `viewer_id`, and the
+    counts only for `emojis`.
+    """
+    impl = dal.get(db)
+    rows = {row["id"]: row for row in impl.posts_by_id(db, post_ids)}
+    rows = [rows[post_id] for post_id in dict.fromkeys(post_ids) if post_id in rows]
+    if not rows:
+        return []
+
+    ids = [row["id"] for row in rows]
+    authors = users.get_many(db, [row["user_id"] for row in rows])
+    reactions = impl.user_reactions(db, viewer_id, ids) if viewer_id else {}
+    counts = impl.reaction_counts(db, ids, emojis) if emojis else {}
+    sources = images.sources(db, [row["image"] for row in rows])
+
+    return [Post(row, authors[row["user_id"]], reactions.get(row["id"]), counts.get(row["id"], {}),
+                 sources.get(row["image"], []))
+            for row in rows if row["user_id"] in authors]
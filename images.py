@@ -0,0 +1,214 @@
+"""
+Off-request image processing.
+
+save_image() only streams the upload into blob storage; the resize work
+happens in a process pool. Each worker fixes the orientation, shrinks the
+original to its size limit, and writes WebP (and AVIF, when Pillow supports
+it) derivatives at every width in SIZES that is smaller than the image,
+putting each into the same storage. Derivative paths are recorded in
+`image_derivatives` so the post cards can emit a srcset.
+
+Every output is stored under the SHA-256 of its own bytes, like an upload,
+and a stored name is never written again, so every /uploads/ URL can be
+cached as immutable from the first request. Once the files are in place the
+worker points the posts (or profiles) using the original at the processed
+blob and moves the blob references over; the original is then swept like
+any unused upload. `processed_uploads` remembers the result, so uploading
+the same file again only repoints the new row. Profiles pick up the new
+image when their entry in the user cache expires.
+"""
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import uploads
+
+SIZES = (200, 400, 900)
+
+# Size limit per kind of upload, and how the rows using it are repointed.
+KINDS = {
+    "post": (900, "UPDATE posts SET image = :new, version = version + 1 WHERE image = :old"),
+    "profile": (400, "UPDATE users SET profile_image = :new WHERE profile_image = :old"),
+}
+
+# Only still formats get derivatives; a GIF may be animated.
+DERIVATIVE_SOURCES = {"png", "jpg", "jpeg"}
+
+# Best first; also the order of the <source> elements.
+FORMAT_PREFERENCE = ("avif", "webp")
+
+WORKERS = 2
+
+_pool = None
+
+
+def _formats():
+    from PIL import features
+    formats = ["webp"]
+    try:
+        if features.check("avif"):
+            formats.insert(0, "avif")
+    except ValueError:
+        pass
+    return formats
+
+
+def process_later(db_path, store, name, kind):
+    """Queues the blob `name` (already in `store`), uploaded as `kind` (see KINDS), for processing."""
+    global _pool
+    if _pool is None:
+        # Not fork: the server has threads (the writer, the background jobs)
+        # whose locks a forked child could inherit held.
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    future = _pool.submit(process, db_path, store, name, kind)
+    future.add_done_callback(_report_failure)
+
+
+def _report_failure(future):
+    if future.exception():
+        print(f"Error processing image: {future.exception()}")
+
+
+def process(db_path, store, name, kind):
+    db = sqlite3.connect(db_path, timeout=30)
+    try:
+        if not _reuse(db, name, kind):
+            processed, derivatives = _render(store, name, KINDS[kind][0])
+            _repoint(db, name, kind, processed, derivatives)
+    finally:
+        db.close()
+
+
+def _reuse(db, name, kind):
+    """Repoints to an earlier result for the same file, if it is still stored. Returns True if it did."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        row = db.execute("SELECT processed FROM processed_uploads WHERE original = ? AND kind = ?",
+                         (name, kind)).fetchone()
+        if row:
+            _move_references(db, name, kind, row[0])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return row is not None
+
+
+def _render(store, name, max_size):
+    """
+    Stores the processed image and its derivatives. Returns the processed
+    blob's name and (format, width, blob name) for each derivative.
+    """
+    # Imported here so only the worker processes pay for PIL.
+    from PIL import Image, ImageOps
+
+    ext = name.rsplit(".", 1)[1]
+    spooled = []  # (spool path, ext)
+    derivatives = []  # (format, width, index into spooled)
+
+    with store.local_copy(name) as path, Image.open(path) as img:
+        # Lets the JPEG decoder downscale by a power of two while decoding.
+        img.draft("RGB", (max_size, max_size))
+        img = ImageOps.exif_transpose(img)
+
+        if max(img.size) > max_size:
+            img.thumbnail((max_size, max_size))
+        spooled.append((_spool(store, img, ext, Image.registered_extensions()[f".{ext.lower()}"]), ext))
+
+        if ext.lower() in DERIVATIVE_SOURCES:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+
+            for fmt in _formats():
+                for size in SIZES:
+                    if size > max_size or size >= max(img.size):
+                        continue
+                    resized = img.copy()
+                    resized.thumbnail((size, size))
+                    derivatives.append((fmt, resized.width, len(spooled)))
+                    spooled.append((_spool(store, resized, fmt, fmt.upper()), fmt))
+
+                # The full-size image in the modern format as well.
+                derivatives.append((fmt, img.width, len(spooled)))
+                spooled.append((_spool(store, img, fmt, fmt.upper()), fmt))
+
+    try:
+        names = []
+        for spool_path, blob_ext in spooled:
+            blob = f"{_digest(spool_path)}.{blob_ext}"
+            if not store.exists(blob):
+                store.put_file(blob, spool_path)
+            names.append(blob)
+    finally:
+        for spool_path, _ in spooled:
+            os.remove(spool_path)
+    return names[0], [(fmt, width, names[i]) for fmt, width, i in derivatives]
+
+
+def _repoint(db, name, kind, processed, derivatives):
+    processed_url = uploads.URL_PREFIX + processed
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        _move_references(db, name, kind, processed)
+        db.execute("INSERT OR REPLACE INTO processed_uploads (original, kind, processed) VALUES (?, ?, ?)",
+                   (name, kind, processed))
+        db.executemany("""
+            INSERT OR REPLACE INTO image_derivatives (image, format, width, path) VALUES (?, ?, ?, ?)
+        """, [(processed_url, fmt, width, uploads.URL_PREFIX + blob) for fmt, width, blob in derivatives])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _move_references(db, name, kind, processed):
+    if processed == name:
+        return
+    moved = db.execute(KINDS[kind][1], {"old": uploads.URL_PREFIX + name,
+                                        "new": uploads.URL_PREFIX + processed}).rowcount
+    uploads.transfer(db, uploads.URL_PREFIX + name, uploads.URL_PREFIX + processed, moved)
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(uploads.CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _spool(store, img, ext, fmt):
+    fd, path = tempfile.mkstemp(dir=store.spool_dir, suffix=f".{ext}")
+    with os.fdopen(fd, "wb") as out:
+        img.save(out, fmt)
+    return path
+
+
+def sources(db, images):
+    """
+    Returns {image: [(mime_type, srcset), ...]} for the given upload paths,
+    best format first. Images without derivatives are left out.
+    """
+    images = [image for image in set(images) if image]
+    if not images:
+        return {}
+
+    placeholders = ",".join("?" * len(images))
+    rows = db.execute(f"""
+        SELECT image, format, width, path FROM image_derivatives
+        WHERE image IN ({placeholders})
+        ORDER BY image, format, width
+    """, images).fetchall()
+
+    by_format = {}
+    for image, fmt, width, path in rows:
+        by_format.setdefault(image, {}).setdefault(fmt, []).append(f"{path} {width}w")
+
+    return {
+        image: [(f"image/{fmt}", ", ".join(by_format[image][fmt]))
+                for fmt in FORMAT_PREFERENCE if fmt in by_format[image]]
+        for image in by_format
+    }
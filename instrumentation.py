@@ -0,0 +1,304 @@
+"""
+Opt-in request instrumentation (INSTRUMENT=1).
+
+Each request gets a Recorder. Connections from get_db() are opened as
+InstrumentedConnection, whose cursors record every statement's text,
+duration (execute plus fetching) and row count. Template rendering and
+any span() around slow work (sentiment scoring, the writer) are timed too.
+The totals go out in a Server-Timing header and into the histograms that
+/_debug/metrics exposes in Prometheus text format. Requests over
+SLOW_REQUEST_MS are logged with their slowest statements, for a
+SLOW_REQUEST_SAMPLE fraction of them.
+
+Background work that has no request, like link-preview fetches, reports
+through observe() instead.
+
+With DEBUG_ENDPOINTS set, `?_profile=cprofile` (or `pyinstrument`, if it
+is installed) on any URL returns a profile of that request instead of the
+page.
+"""
+import contextvars
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOWEST_LOGGED = 5
+PROFILE_LINES = 40
+
+_current = contextvars.ContextVar("instrumentation_recorder", default=None)
+
+
+class Recorder:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []  # [sql, seconds, rows]
+        self.spans = {}       # name -> seconds
+        self._template_depth = 0
+        self._template_started = None
+
+    def statement(self, sql, seconds, rows):
+        record = [sql, seconds, rows]
+        self.statements.append(record)
+        return record
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def db_seconds(self):
+        return sum(record[1] for record in self.statements)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _record = None
+
+    def _run(self, method, sql, parameters):
+        recorder = _current.get()
+        if recorder is None:
+            self._record = None
+            return method(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            self._record = recorder.statement(sql, time.perf_counter() - start, max(self.rowcount, 0))
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self._run(super().executemany, sql, parameters)
+
+    def _fetch(self, fetch, *args):
+        if self._record is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        rows = fetch(*args)
+        self._record[1] += time.perf_counter() - start
+        if rows is not None:
+            self._record[2] += len(rows) if isinstance(rows, list) else 1
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+def start():
+    """Starts recording the current request. Returns the Recorder."""
+    recorder = Recorder()
+    _current.set(recorder)
+    return recorder
+
+
+def stop():
+    recorder = _current.get()
+    _current.set(None)
+    return recorder
+
+
+@contextmanager
+def span(name):
+    """Times the block as `name` in the current request, if it is being recorded."""
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, time.perf_counter() - start_time)
+
+
+def template_started(sender, **extra):
+    recorder = _current.get()
+    if recorder is not None:
+        # Post cards render inside the page; only the outermost render counts.
+        if recorder._template_depth == 0:
+            recorder._template_started = time.perf_counter()
+        recorder._template_depth += 1
+
+
+def template_finished(sender, **extra):
+    recorder = _current.get()
+    if recorder is not None and recorder._template_depth:
+        recorder._template_depth -= 1
+        if recorder._template_depth == 0:
+            recorder.add("template", time.perf_counter() - recorder._template_started)
+
+
+def server_timing(recorder):
+    parts = [f'db;dur={recorder.db_seconds() * 1000:.1f};desc="{len(recorder.statements)} queries"']
+    parts += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in recorder.spans.items()]
+    parts.append(f"total;dur={recorder.elapsed() * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def slow_request_log(recorder, method, path):
+    spans = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in recorder.spans.items())
+    lines = [f"SLOW {method} {path} {recorder.elapsed() * 1000:.1f} ms: db {recorder.db_seconds() * 1000:.1f} ms "
+             f"in {len(recorder.statements)} queries" + (f", {spans}" if spans else "")]
+    for sql, seconds, rows in sorted(recorder.statements, key=lambda record: -record[1])[:SLOWEST_LOGGED]:
+        lines.append(f"    {seconds * 1000:8.1f} ms {rows:6} rows  {' '.join(sql.split())[:200]}")
+    return "\n".join(lines)
+
+
+def should_log(recorder, slow_ms, sample_rate):
+    return recorder.elapsed() * 1000 >= slow_ms and random.random() < sample_rate
+
+
+class Histogram:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+
+    def observe(self, label_value, seconds):
+        series = self._series.setdefault(label_value, [0] * len(BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for value, series in sorted(self._series.items()):
+            label = f'{self.label}="{_escape(value)}"'
+            for bound, count in zip(BUCKETS, series):
+                yield f'{self.name}_bucket{{{label},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}'
+            yield f"{self.name}_sum{{{label}}} {series[-2]:.6f}"
+            yield f"{self.name}_count{{{label}}} {series[-1]}"
+
+
+class Counter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for value, total in sorted(self._values.items()):
+            yield f'{self.name}{{{self.label}="{_escape(value)}"}} {total:g}'
+
+
+_lock = threading.Lock()
+REQUEST_SECONDS = Histogram("chrpi_request_seconds", "Request duration by endpoint.", "endpoint")
+DB_SECONDS = Histogram("chrpi_request_db_seconds", "Time spent in SQL per request, by endpoint.", "endpoint")
+DB_QUERIES = Counter("chrpi_db_queries_total", "SQL statements run by requests, by endpoint.", "endpoint")
+DB_ROWS = Counter("chrpi_db_rows_total", "Rows returned or changed by request SQL, by endpoint.", "endpoint")
+SPAN_SECONDS = Histogram("chrpi_span_seconds", "Timed sections of requests (templates, sentiment, writes).", "span")
+BACKGROUND_SECONDS = Histogram("chrpi_background_seconds",
+                               "Work outside requests, such as outbound HTTP for link previews.", "job")
+BACKGROUND_ERRORS = Counter("chrpi_background_errors_total", "Failed background work.", "job")
+METRICS = (REQUEST_SECONDS, DB_SECONDS, DB_QUERIES, DB_ROWS, SPAN_SECONDS, BACKGROUND_SECONDS, BACKGROUND_ERRORS)
+
+
+def record_request(recorder, endpoint):
+    endpoint = endpoint or "unknown"
+    with _lock:
+        REQUEST_SECONDS.observe(endpoint, recorder.elapsed())
+        DB_SECONDS.observe(endpoint, recorder.db_seconds())
+        DB_QUERIES.inc(endpoint, len(recorder.statements))
+        DB_ROWS.inc(endpoint, sum(record[2] for record in recorder.statements))
+        for name, seconds in recorder.spans.items():
+            SPAN_SECONDS.observe(name, seconds)
+
+
+def observe(job, seconds, failed=False):
+    """Records background work (no request to attach it to)."""
+    with _lock:
+        BACKGROUND_SECONDS.observe(job, seconds)
+        if failed:
+            BACKGROUND_ERRORS.inc(job)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _gauges(prefix, stats):
+    """Flattens a module's stats() dict into gauge lines; nested dicts become a `key` label."""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            for name, inner in value.items():
+                if isinstance(inner, (int, float)):
+                    yield f'chrpi_{prefix}_{name}{{key="{_escape(key)}"}} {float(inner):g}'
+        elif isinstance(value, (int, float)):
+            yield f"chrpi_{prefix}_{key} {float(value):g}"
+
+
+def exposition(gauges):
+    """
+    The Prometheus text format for every metric, plus `gauges`, a dict of
+    prefix -> stats() dict from the caches and pools.
+    """
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.lines()]
+    for prefix, stats in gauges.items():
+        lines.extend(_gauges(prefix, stats))
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """A cProfile or pyinstrument capture of one request."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler as PyinstrumentProfiler
+            self._profiler = PyinstrumentProfiler()
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def report(self):
+        """Stops the capture. Returns (body, mimetype)."""
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+            return self._profiler.output_html(), "text/html"
+        import io
+        import pstats
+        self._profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        return out.getvalue(), "text/plain"
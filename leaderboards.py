@@ -0,0 +1,187 @@
+"""
+Precomputed /top rankings.
+
+`leaderboard_entries` holds the top BOARD_SIZE posts for each board ('all',
+'combo' and one per emoji) and `weekly_reactions` the 7-day emoji totals for
+the sidebar. A background thread rebuilds them once they are older than the
+staleness budget, and apply_reaction() nudges them between rebuilds so new
+smiles show up right away.
+"""
+import sqlite3
+import threading
+import time
+
+import db_pool
+
+BOARD_SIZE = 100
+
+# A combo post needs at least this many different reaction emojis.
+COMBO_MIN_EMOJIS = 3
+
+WEEKLY_WINDOW = "-7 days"
+
+ENTRY_ORDER = "score DESC, smiles DESC, timestamp DESC, post_id DESC"
+
+
+def board_names(emojis):
+    return ["all", "combo"] + list(emojis)
+
+
+def last_refreshed(db):
+    row = db.execute("SELECT refreshed_at FROM leaderboard_meta WHERE id = 1").fetchone()
+    return row[0] if row else None
+
+
+def refresh(db, emojis, max_age=None):
+    """
+    Rebuilds every board and the weekly totals from scratch. With `max_age`
+    (seconds), does nothing if another process refreshed more recently.
+    Returns True if a rebuild happened.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        refreshed_at = last_refreshed(db)
+        if max_age is not None and refreshed_at and time.time() - refreshed_at < max_age:
+            db.rollback()
+            return False
+
+        db.execute("DELETE FROM leaderboard_entries")
+        db.execute("""
+            INSERT INTO leaderboard_entries (board, post_id, score, smiles, timestamp)
+            SELECT 'all', id, smiles, smiles, timestamp FROM posts
+            WHERE deleted_at IS NULL
+            ORDER BY smiles DESC, timestamp DESC, id DESC
+            LIMIT ?
+        """, (BOARD_SIZE,))
+        db.execute("""
+            INSERT INTO leaderboard_entries (board, post_id, score, smiles, timestamp)
+            SELECT 'combo', posts.id, diversity.emojis, posts.smiles, posts.timestamp
+            FROM (SELECT post_id, COUNT(*) AS emojis FROM post_reaction_counts
+                  GROUP BY post_id HAVING COUNT(*) >= ?) AS diversity
+            JOIN posts ON posts.id = diversity.post_id
+            WHERE posts.deleted_at IS NULL
+            ORDER BY diversity.emojis DESC, posts.smiles DESC, posts.timestamp DESC, posts.id DESC
+            LIMIT ?
+        """, (COMBO_MIN_EMOJIS, BOARD_SIZE))
+        for emoji in emojis:
+            db.execute("""
+                INSERT INTO leaderboard_entries (board, post_id, score, smiles, timestamp)
+                SELECT post_reaction_counts.emoji, posts.id, post_reaction_counts.count, posts.smiles, posts.timestamp
+                FROM post_reaction_counts
+                JOIN posts ON posts.id = post_reaction_counts.post_id
+                WHERE post_reaction_counts.emoji = ? AND posts.deleted_at IS NULL
+                ORDER BY post_reaction_counts.count DESC, posts.smiles DESC, posts.timestamp DESC, posts.id DESC
+                LIMIT ?
+            """, (emoji, BOARD_SIZE))
+
+        db.execute("DELETE FROM weekly_reactions")
+        db.execute("""
+            INSERT INTO weekly_reactions (emoji, count)
+            SELECT emoji, SUM(count) FROM post_reaction_counts
+            WHERE post_id IN (SELECT id FROM posts WHERE timestamp > datetime('now', ?) AND deleted_at IS NULL)
+            GROUP BY emoji
+        """, (WEEKLY_WINDOW,))
+
+        db.execute("INSERT OR REPLACE INTO leaderboard_meta (id, refreshed_at) VALUES (1, ?)", (time.time(),))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return True
+
+
+def ensure_built(db, emojis):
+    """Builds the boards if they never have been, so /top doesn't start empty. Run at startup."""
+    if last_refreshed(db) is None:
+        refresh(db, emojis, max_age=float("inf"))
+
+
+def apply_reaction(db, post_id, old_emoji, new_emoji):
+    """
+    Moves `post_id` within the affected boards after a smile. `old_emoji` is
+    the reaction it replaced, or None for a brand-new reaction. Runs inside
+    the caller's transaction.
+    """
+    if old_emoji == new_emoji:
+        return
+
+    post = db.execute("""
+        SELECT smiles, timestamp, timestamp > datetime('now', ?) AS recent FROM posts WHERE id = ?
+    """, (WEEKLY_WINDOW, post_id)).fetchone()
+    if not post:
+        return
+    smiles, timestamp, recent = post
+    counts = dict(db.execute("SELECT emoji, count FROM post_reaction_counts WHERE post_id = ?",
+                             (post_id,)).fetchall())
+
+    db.execute("UPDATE leaderboard_entries SET smiles = ? WHERE post_id = ?", (smiles, post_id))
+    _place(db, "all", post_id, smiles, smiles, timestamp)
+    _place(db, new_emoji, post_id, counts.get(new_emoji, 0), smiles, timestamp)
+    if old_emoji:
+        _place(db, old_emoji, post_id, counts.get(old_emoji, 0), smiles, timestamp)
+    emojis_used = len(counts) if len(counts) >= COMBO_MIN_EMOJIS else 0
+    _place(db, "combo", post_id, emojis_used, smiles, timestamp)
+
+    if recent:
+        _bump_weekly(db, new_emoji, 1)
+        if old_emoji:
+            _bump_weekly(db, old_emoji, -1)
+
+
+def _place(db, board, post_id, score, smiles, timestamp):
+    if score <= 0:
+        db.execute("DELETE FROM leaderboard_entries WHERE board = ? AND post_id = ?", (board, post_id))
+        return
+
+    db.execute("""
+        INSERT INTO leaderboard_entries (board, post_id, score, smiles, timestamp) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (board, post_id) DO UPDATE SET score = excluded.score, smiles = excluded.smiles
+    """, (board, post_id, score, smiles, timestamp))
+    db.execute(f"""
+        DELETE FROM leaderboard_entries WHERE board = ? AND post_id NOT IN (
+            SELECT post_id FROM leaderboard_entries WHERE board = ? ORDER BY {ENTRY_ORDER} LIMIT ?
+        )
+    """, (board, board, BOARD_SIZE))
+
+
+def _bump_weekly(db, emoji, delta):
+    db.execute("""
+        INSERT INTO weekly_reactions (emoji, count) VALUES (?, ?)
+        ON CONFLICT (emoji) DO UPDATE SET count = count + excluded.count
+    """, (emoji, delta))
+
+
+def remove_post(db, post_id):
+    """Drops a deleted post from every board. Runs inside the caller's transaction."""
+    db.execute("DELETE FROM leaderboard_entries WHERE post_id = ?", (post_id,))
+
+
+def weekly_totals(db):
+    return db.execute("""
+        SELECT emoji, count FROM weekly_reactions WHERE count > 0 ORDER BY count DESC
+    """).fetchall()
+
+
+_refresher = None
+
+
+def start_refresher(db_path, emojis, max_age):
+    """
+    Starts the background thread that rebuilds the boards once they are
+    older than `max_age` seconds. Safe to call more than once.
+    """
+    global _refresher
+    if _refresher is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(max_age / 2)
+            try:
+                with db_pool.connection(db_path) as db:
+                    refresh(db, emojis, max_age)
+            except sqlite3.Error as e:
+                print(f"Error refreshing leaderboards: {e}")
+
+    _refresher = threading.Thread(target=run, name="leaderboard-refresher", daemon=True)
+    _refresher.start()
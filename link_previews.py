@@ -0,0 +1,162 @@
+"""
+Background link-preview fetching with a persistent URL cache.
+
+create_post() stores the post straight away and hands the link to a small
+thread pool. The worker reads only the page's <head> (capped at MAX_BYTES)
+over a pooled requests.Session, records the result in `link_previews`, and
+fills in `posts.image`. Failed lookups are cached too, for a shorter time,
+so a dead link is not re-fetched by every post that shares it.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import db_pool
+import instrumentation
+
+PREVIEW_TTL = 7 * 24 * 3600
+NEGATIVE_TTL = 3600
+
+FETCH_TIMEOUT = 5
+MAX_BYTES = 256 * 1024
+CHUNK_SIZE = 16 * 1024
+WORKERS = 4
+
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+# requests and BeautifulSoup are only imported once the first preview is
+# fetched, which keeps them off the app's import path.
+_session = None
+_executor = None
+_lock = threading.Lock()
+# url -> post ids waiting on a fetch that is already queued
+_pending = {}
+
+
+def cached_image(db, url):
+    """
+    Returns the cached preview image for `url` ("" for a cached miss), or
+    None if there is no fresh cache entry.
+    """
+    row = db.execute("SELECT image, fetched_at FROM link_previews WHERE url = ?", (url,)).fetchone()
+    if not row:
+        return None
+    image, fetched_at = row
+    ttl = PREVIEW_TTL if image else NEGATIVE_TTL
+    if time.time() - fetched_at > ttl:
+        return None
+    return image
+
+
+def store(db, url, image):
+    db.execute("INSERT OR REPLACE INTO link_previews (url, image, fetched_at) VALUES (?, ?, ?)",
+               (url, image, time.time()))
+
+
+def prune(db):
+    """Drops cache entries past their TTL. Returns how many were dropped."""
+    now = time.time()
+    cur = db.execute("""
+        DELETE FROM link_previews
+        WHERE fetched_at < ? OR (image = '' AND fetched_at < ?)
+    """, (now - PREVIEW_TTL, now - NEGATIVE_TTL))
+    return cur.rowcount
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=WORKERS, pool_maxsize=WORKERS))
+        session.mount("https://", HTTPAdapter(pool_connections=WORKERS, pool_maxsize=WORKERS))
+        _session = session
+    return _session
+
+
+def schedule(db_path, post_id, url):
+    """Queues a preview fetch that fills in `post_id`'s image when done."""
+    global _executor
+    with _lock:
+        if url in _pending:
+            _pending[url].append(post_id)
+            return
+        _pending[url] = [post_id]
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="link-preview")
+    _executor.submit(_run, db_path, url)
+
+
+def _run(db_path, url):
+    try:
+        with db_pool.connection(db_path) as db:
+            image = cached_image(db, url)
+            if image is None:
+                image = fetch_preview_image(url)
+                store(db, url, image)
+                db.commit()
+
+            with _lock:
+                post_ids = _pending.pop(url, [])
+            if image:
+                db.executemany("""
+                    UPDATE posts SET image = ?, version = version + 1
+                    WHERE id = ? AND image = '' AND deleted_at IS NULL
+                """, [(image, post_id) for post_id in post_ids])
+                db.commit()
+    except Exception as e:
+        with _lock:
+            _pending.pop(url, None)
+        print(f"DEBUG: Link preview worker failed for {url}. Error: {e}")
+
+
+def _read_head(response):
+    """Reads the response body up to and including </head>, at most MAX_BYTES."""
+    body = b""
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        start = max(0, len(body) - len(b"</head>"))
+        body += chunk
+        end = body.lower().find(b"</head>", start)
+        if end != -1:
+            return body[:end + len(b"</head>")]
+        if len(body) >= MAX_BYTES:
+            break
+    return body[:MAX_BYTES]
+
+
+def fetch_preview_image(url: str):
+    if not url:
+        return ""
+
+    from bs4 import BeautifulSoup
+
+    started = time.perf_counter()
+    try:
+        with _get_session().get(url, headers=HEADERS, timeout=FETCH_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            head = _read_head(response)
+    except Exception as e:
+        instrumentation.observe("link_preview_fetch", time.perf_counter() - started, failed=True)
+        print(f"DEBUG: Failed to get link preview for {url}. Error: {e}")
+        return ""
+    instrumentation.observe("link_preview_fetch", time.perf_counter() - started)
+
+    try:
+        soup = BeautifulSoup(head, 'html.parser')
+
+        og_image = soup.find("meta", property="og:image")
+        if og_image and og_image.get("content"):
+            image_url = og_image.get("content")
+
+            return urljoin(url, image_url)
+
+        favicon = soup.find("link", rel="icon")
+        if favicon and favicon.get("href"):
+            return urljoin(url, favicon.get("href"))
+
+    except Exception as e:
+        print(f"DEBUG: Failed to get link preview for {url}. Error: {e}")
+        return ""
+    return ""
@@ -0,0 +1,99 @@
+"""
+In-process pub/sub for live reaction counts.
+
+smile() publishes each post's new counts after the write commits, and every
+open page holds a Server-Sent Events stream subscribed to the posts it shows.
+A subscriber keeps only the newest update per post, so a burst of reactions
+on one post reaches a slow client as a single event. Updates carry the post
+version, so the browser can drop one that arrives after a newer one.
+
+The bus lives in one process: a page streaming from one worker does not see
+reactions handled by another until it reloads.
+
+A stream holds a worker thread while it is open, so each one ends after
+STREAM_LIFETIME seconds and the browser's EventSource reconnects RETRY_MS
+later. Reactions in that gap arrive with the next update to the post.
+"""
+import json
+import threading
+import time
+
+KEEPALIVE = 15
+STREAM_LIFETIME = 30
+RETRY_MS = 1000
+MAX_POSTS = 200
+
+_subscribers = {}  # post id -> set of subscriptions
+_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self, post_ids):
+        self.post_ids = set(post_ids)
+        self._pending = {}
+        self._ready = threading.Condition()
+
+    def _deliver(self, post_id, version, counts):
+        with self._ready:
+            current = self._pending.get(post_id)
+            if current is None or current[0] < version:
+                self._pending[post_id] = (version, counts)
+                self._ready.notify()
+
+    def wait(self, timeout=KEEPALIVE):
+        """Returns {post_id: (version, counts)} received since the last call; {} on timeout."""
+        with self._ready:
+            if not self._pending:
+                self._ready.wait(timeout)
+            pending, self._pending = self._pending, {}
+        return pending
+
+
+def subscribe(post_ids):
+    subscription = Subscription(list(post_ids)[:MAX_POSTS])
+    with _lock:
+        for post_id in subscription.post_ids:
+            _subscribers.setdefault(post_id, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        for post_id in subscription.post_ids:
+            watchers = _subscribers.get(post_id)
+            if watchers:
+                watchers.discard(subscription)
+                if not watchers:
+                    del _subscribers[post_id]
+
+
+def publish(post_id, version, counts):
+    with _lock:
+        watchers = list(_subscribers.get(post_id, ()))
+    for subscription in watchers:
+        subscription._deliver(post_id, version, counts)
+
+
+def event_stream(subscription):
+    """Yields the SSE stream for `subscription` until the client goes away or STREAM_LIFETIME is up."""
+    deadline = time.monotonic() + STREAM_LIFETIME
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            updates = subscription.wait(min(KEEPALIVE, remaining))
+            if not updates:
+                yield ": keepalive\n\n"
+            for post_id, (version, counts) in updates.items():
+                data = json.dumps({"post_id": post_id, "version": version, "counts": counts})
+                yield f"event: reactions\ndata: {data}\n\n"
+    finally:
+        unsubscribe(subscription)
+
+
+def stats():
+    with _lock:
+        return {"posts_watched": len(_subscribers),
+                "subscriptions": len({s for watchers in _subscribers.values() for s in watchers})}
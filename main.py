@@ -1,27 +1,43 @@
+import click
+import functools
 import os
-import sqlite3
-import uuid
 import random
+import sqlite3
+import threading
+import time
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, session, g, flash, url_for
+from flask import Flask, render_template, request, redirect, session, g, flash, url_for, has_request_context, jsonify, abort, Response, make_response, template_rendered, before_render_template
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from urllib.parse import urlparse, urljoin
-from PIL import Image, ImageOps
-from textblob import TextBlob
-from flask_wtf.csrf import CSRFProtect
+from urllib.parse import urlparse
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 from dotenv import load_dotenv
-import requests
-from bs4 import BeautifulSoup
-import nltk
-
-# This ensures the sentiment analysis data is present on the server
-try:
-    nltk.data.find('corpora/movie_reviews')
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    import textblob.download_corpora
-    textblob.download_corpora.main()
+
+import bulk
+import cleanup
+import dal
+import db_pool
+import fragments
+import http_cache
+import hydration
+import images
+import instrumentation
+import leaderboards
+import link_previews
+import live
+import migrations
+import mutations
+import query_plans
+import reactions
+import search_index
+import sentiment
+import storage
+import trending
+import uploads
+import users
+import writer
+from pagination import decode_cursor, keyset_page
+
 
 # Load environment variables
 load_dotenv()
@@ -43,9 +59,24 @@ ALLOWED_EXT = {"png", "jpg", "jpeg", "gif"}
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "amhdnrba!102998")
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+app.config["DATABASE"] = DB_PATH
+# Enables the /_debug/* endpoints.
+app.config["DEBUG_ENDPOINTS"] = bool(os.environ.get("DEBUG_ENDPOINTS"))
+# Per-request SQL, template and span timings; see instrumentation.py.
+app.config["INSTRUMENT"] = bool(os.environ.get("INSTRUMENT"))
+# With INSTRUMENT, log this fraction of requests slower than SLOW_REQUEST_MS.
+app.config["SLOW_REQUEST_MS"] = float(os.environ.get("SLOW_REQUEST_MS", 500))
+app.config["SLOW_REQUEST_SAMPLE"] = float(os.environ.get("SLOW_REQUEST_SAMPLE", 1.0))
+# How stale (in seconds) the precomputed /top rankings may get before a rebuild.
+app.config["LEADERBOARD_MAX_AGE"] = int(os.environ.get("LEADERBOARD_MAX_AGE", 300))
+# Rejects oversized requests before Werkzeug spools them; uploads.receive()
+# enforces the exact limit on the image itself.
+app.config["MAX_CONTENT_LENGTH"] = uploads.MAX_UPLOAD_BYTES + 1024 * 1024
 
 # Ensure the folder exists (especially on the new /data disk)
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+# Local folder or S3 bucket, see storage.py.
+app.config["STORAGE"] = storage.from_env(app.config["UPLOAD_FOLDER"])
 
 # Initialize CSRF Protection
 csrf = CSRFProtect(app)
@@ -53,6 +84,9 @@ csrf = CSRFProtect(app)
 
 ALLOWED_EMOJIS = ['😊', '😂', '🥹', '🥰', '🤩', '🥳']
 
+FEED_PAGE_SIZE = 20
+GUEST_PAGE_SIZE = 10
+
 
 def format_iso(value):
     if value is None:
@@ -68,68 +102,181 @@ app.jinja_env.filters['datetime'] = format_iso
 
 
 # DB Helpers
-def get_db():
-    db = getattr(g, "_database", None)
-    if db is None:
-        db = g._database = sqlite3.connect(DB_PATH)
-        db.row_factory = sqlite3.Row
-    return db
+def get_db(write=False):
+    """
+    Returns a pooled connection for the current request. GET and HEAD
+    requests get a read-only connection unless `write` is set.
+    """
+    readonly = not write and has_request_context() and request.method in ("GET", "HEAD")
+    databases = g.setdefault("_databases", {})
+    if readonly not in databases:
+        factory = instrumentation.InstrumentedConnection if app.config["INSTRUMENT"] else sqlite3.Connection
+        pool = db_pool.get_pool(app.config["DATABASE"], readonly, factory)
+        db = pool.acquire()
+        db.set_trace_callback(app.config.get("SQL_TRACE"))
+        databases[readonly] = (pool, db)
+    return databases[readonly][1]
 
 
 @app.teardown_appcontext
 def close_db(exc):
-    db = getattr(g, "_database", None)
-    if db:
-        db.close()
+    for pool, db in g.pop("_databases", {}).values():
+        pool.release(db)
+
+
+def write(op, *args):
+    """Runs a mutations.* operation on the single writer; returns once committed."""
+    with instrumentation.span("writer"):
+        return writer.submit(app.config["DATABASE"], op, *args)
 
 
 def init_db():
-    db = get_db()
+    """
+    Brings the schema up to date and builds the /top boards if the database
+    has none yet. Runs once per process (and from `flask --app main
+    migrate`), never on the request path.
+    """
+    with app.app_context():
+        db = get_db()
+        applied = migrations.migrate(db)
+        leaderboards.ensure_built(db, ALLOWED_EMOJIS)
+        trending.ensure_built(db)
+    return applied
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations to chrpi.db."""
+    applied = init_db()
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print(f"Schema already at version {migrations.LATEST_VERSION}.")
+
+
+@app.cli.command("warm-up")
+def warm_up_command():
+    """Download missing NLTK corpora and check that sentiment scoring works."""
+    sentiment.warm_up()
+    print("Sentiment analysis is ready.")
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if any route's SQL falls back to a full table scan."""
+    problems = query_plans.check(app, ALLOWED_EMOJIS)
+    seen = set()
+    for route, table, sql in problems:
+        if (route, table) in seen:
+            continue
+        seen.add((route, table))
+        print(f"FULL SCAN of {table} on {route}:\n    {' '.join(sql.split())}\n")
+    if problems:
+        raise SystemExit(1)
+    print("All query plans use indexes.")
+
+
+@app.cli.command("rebuild-reaction-counts")
+def rebuild_reaction_counts_command():
+    """Reconcile post_reaction_counts with post_smiles."""
+    drift = reactions.rebuild_counts(get_db())
+    print(f"Rebuilt reaction counts ({drift} counters corrected).")
+
+
+@app.cli.command("check-dal-parity")
+@click.argument("postgres_url")
+def check_dal_parity_command(postgres_url):
+    """Compare the SQLite and PostgreSQL data-access layers on one scenario."""
+    import dal_parity
+    differences = dal_parity.check(postgres_url)
+    for step, sqlite_result, postgres_result in differences:
+        print(f"MISMATCH at {step}:\n    sqlite:   {sqlite_result!r}\n    postgres: {postgres_result!r}\n")
+    if differences:
+        raise SystemExit(1)
+    print("SQLite and PostgreSQL data-access layers agree.")
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuild the full-text search indexes from users and posts."""
+    search_index.rebuild(get_db())
+    print("Search indexes rebuilt.")
+
+
+@app.cli.command("sweep-uploads")
+def sweep_uploads_command():
+    """Delete uploaded images no post or profile has used for an hour."""
+    total = cleanup.sweep_uploads(get_db(), app.config["STORAGE"])
+    print(f"Deleted {total} unused uploads.")
+
+
+@app.cli.command("collect-garbage")
+def collect_garbage_command():
+    """Purge deleted posts, unused uploads, orphaned files and free pages now."""
+    done = cleanup.collect(get_db(), app.config["STORAGE"], maintenance=True)
+    print(", ".join(f"{name}: {count}" for name, count in done.items()))
+
+
+@app.cli.command("vacuum")
+def vacuum_command():
+    """Rebuild the database file and switch it to incremental auto-vacuum."""
+    cleanup.full_vacuum(get_db())
+    print("Database vacuumed.")
+
+
+@app.cli.command("refresh-leaderboards")
+def refresh_leaderboards_command():
+    """Rebuild the precomputed /top rankings now."""
+    leaderboards.refresh(get_db(), ALLOWED_EMOJIS)
+    print("Leaderboards refreshed.")
+
+
+@app.cli.command("export-ndjson")
+@click.argument("output", type=click.File("w", encoding="utf-8"))
+def export_ndjson_command(output):
+    """Stream users, posts, follows and reactions to OUTPUT as NDJSON ("-" for stdout)."""
+    started = time.perf_counter()
+    written = bulk.export(get_db(), output)
+    _report_bulk("Exported", written, time.perf_counter() - started)
+
+
+@app.cli.command("import-ndjson")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--check-sentiment", is_flag=True, help="Skip posts the post form would reject as too negative.")
+def import_ndjson_command(source, check_sentiment):
+    """
+    Load an NDJSON file made by export-ndjson ("-" for stdin) in one transaction.
+
+    Stop the app first: the import holds the database's write lock until it
+    finishes, and the site's writes fail with "database is locked" meanwhile.
+    """
+    started = time.perf_counter()
+    try:
+        counts = bulk.import_lines(get_db(), source, ALLOWED_EMOJIS, check_sentiment)
+    except (bulk.BadLine, sqlite3.IntegrityError) as e:
+        click.echo(f"Import failed, nothing was imported: {e}", err=True)
+        raise SystemExit(1)
+    rejected = counts.pop("rejected_posts")
+    _report_bulk("Imported", counts, time.perf_counter() - started)
+    if check_sentiment:
+        click.echo(f"Skipped {rejected} posts as too negative.", err=True)
+
+
+def _report_bulk(verb, counts, seconds):
+    # Goes to stderr so `export-ndjson -` can be piped.
+    total = sum(counts.values())
+    click.echo(f"{verb} {total} rows in {seconds:.1f}s ({total / max(seconds, 1e-9):,.0f} rows/s): "
+               + ", ".join(f"{table} {count}" for table, count in counts.items()), err=True)
 
-    # Users Table
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        bio TEXT DEFAULT '',
-        profile_image TEXT DEFAULT ''
-    );
-    """)
-
-    # Posts Table
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS posts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        content TEXT NOT NULL,
-        image TEXT DEFAULT '',
-        link TEXT DEFAULT '',
-        smiles INTEGER DEFAULT 0,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    );
-    """)
-
-    # Follows Table
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS follows (
-        follower_id INTEGER,
-        followed_id INTEGER,
-        UNIQUE (follower_id, followed_id)
-    );
-    """)
-
-    # Post Smiles Table
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS post_smiles (
-        user_id INTEGER,
-        post_id INTEGER,
-        reaction_emoji TEXT DEFAULT '😊', -- NEW: Store the specific emoji here
-        UNIQUE (user_id, post_id)
-    );
-    """)
-    db.commit()
+
+@app.cli.command("rebuild-trending")
+def rebuild_trending_command():
+    """Recompute the /top?sort=hot scores from post smile counts."""
+    trending.rebuild(get_db())
+    print("Trending scores rebuilt.")
+
+
+init_db()
 
 
 # Auth & Utility helpers
@@ -137,37 +284,76 @@ def current_user():
     uid = session.get("user_id")
     if not uid:
         return None
-    return get_db().execute("SELECT * FROM users WHERE id = ?", (uid,)).fetchone()
+    if "current_user" not in g:
+        g.current_user = users.get(get_db(), uid)
+    return g.current_user
+
+
+def load_posts(db, post_ids, viewer=None, emojis=ALLOWED_EMOJIS):
+    """
+    The posts with `post_ids`, in that order, with everything the post cards
+    render (see hydration.load), as seen by `viewer`. Reaction counts are
+    loaded for `emojis` only.
+    """
+    return hydration.load(db, post_ids, viewer["id"] if viewer else None, emojis)
+
+
+def render_post_list(template, posts, next_cursor, **context):
+    """
+    Renders a page of posts, with cards from the fragment cache, and a "load
+    more" link for the next cursor.
+    With ?fragment=1 only the next batch of cards (and its own link) is
+    rendered, for the load-more script in base.html.
+    """
+    more_url = None
+    if next_cursor:
+        # Query parameters that url_for() would read as its own arguments are
+        # dropped, and the route's own arguments win over the query string.
+        args = {key: value for key, value in request.args.items()
+                if key not in ("fragment", "endpoint") and not key.startswith("_")}
+        args["before"] = next_cursor
+        more_url = url_for(request.endpoint, **{**args, **request.view_args})
+
+    card_template = context.pop("card_template", "post_card_template.html")
+    cards = fragments.render_cards(card_template, posts, context.get("user"), allowed_emojis=ALLOWED_EMOJIS)
+    if request.args.get("fragment"):
+        template = "post_list_template.html"
+    return render_template(template, posts=posts, cards=cards, more_url=more_url, **context)
 
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXT
 
 
-def save_image(file_storage, resize_to=900):
+def save_image(file_storage):
+    """
+    Streams an upload into blob storage and returns its uploads.Upload, or
+    None if there is no usable file. Raises uploads.UploadTooLarge. Pass the
+    upload to finish_upload() once the row that uses it has committed.
+    """
     if not file_storage or file_storage.filename == "":
-        return ""
+        return None
     if not allowed_file(file_storage.filename):
-        return ""
+        return None
     filename = secure_filename(file_storage.filename)
     ext = filename.rsplit(".", 1)[1].lower()
-    new_name = f"{uuid.uuid4().hex}.{ext}"
-    path = os.path.join(app.config["UPLOAD_FOLDER"], new_name)
-
-    file_storage.save(path)
 
+    store = app.config["STORAGE"]
+    upload = uploads.receive(store, file_storage.stream, ext)
     try:
-        img = Image.open(path)
+        uploads.store(store, upload)
+    except Exception:
+        uploads.discard(upload)
+        raise
+    return upload
 
-        img = ImageOps.exif_transpose(img)
 
-        img.thumbnail((resize_to, resize_to))
-        img.save(path)
-    except Exception as e:
-        print(f"Error saving image: {e}")
-        pass
-
-    return f"/uploads/{new_name}"
+def finish_upload(upload, kind="post"):
+    store = app.config["STORAGE"]
+    uploads.confirm(store, upload)
+    # Orientation, resizing and the srcset derivatives happen off-request;
+    # a file uploaded before only has the new row repointed.
+    images.process_later(app.config["DATABASE"], store, upload.name, kind)
 
 
 def analyze_sentiment(text: str):
@@ -175,13 +361,8 @@ def analyze_sentiment(text: str):
     Returns True if sentiment is positive or neutral (polarity >= -0.1).
     Returns False if sentiment is negative.
     """
-    if not text:
-        return True
-
-    analysis = TextBlob(text)
-    print(f"DEBUG: Text: '{text}' | Polarity: {analysis.sentiment.polarity}")
-
-    return analysis.sentiment.polarity >= -0.1
+    with instrumentation.span("sentiment"):
+        return sentiment.is_positive(text)
 
 
 def get_safe_redirect(target):
@@ -193,40 +374,108 @@ def get_safe_redirect(target):
     return target
 
 
-def get_link_preview_image(url: str):
-    if not url:
-        return ""
+def cached_page(guest_cache=False):
+    """
+    Gives a post-list page a weak ETag from the content version and answers
+    a matching If-None-Match with 304. With `guest_cache`, logged-out
+    visitors are served from the full-page cache in http_cache.py. Pages
+    with pending flash messages are always rendered.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            me = current_user()
+            version = http_cache.content_version(get_db())
+            tag = http_cache.etag(version, me["id"] if me else None)
+            use_guest_cache = guest_cache and not me
+
+            if request.if_none_match.contains_weak(tag):
+                response = Response(status=304)
+            else:
+                page = http_cache.guest_page(request.full_path, version) if use_guest_cache else None
+                if page:
+                    body, mimetype = page
+                    response = Response(body.replace(fragments.CSRF_MARK, generate_csrf()), mimetype=mimetype)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if use_guest_cache:
+                        body = response.get_data(as_text=True)
+                        if g.get("csrf_token"):
+                            body = body.replace(g.csrf_token, fragments.CSRF_MARK)
+                        http_cache.store_guest_page(request.full_path, version, body, response.mimetype)
+
+            response.set_etag(tag, weak=True)
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator
 
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers, timeout=5)
-        response.raise_for_status()
 
-        soup = BeautifulSoup(response.content, 'html.parser')
+# Routes
+@app.before_request
+def start_instrumentation():
+    kind = request.args.get("_profile")
+    if app.config["DEBUG_ENDPOINTS"] and kind in ("cprofile", "pyinstrument"):
+        try:
+            g.profiler = instrumentation.Profiler(kind)
+        except ImportError:
+            abort(400, f"{kind} is not installed")
+    if app.config["INSTRUMENT"]:
+        g.recorder = instrumentation.start()
+
 
-        og_image = soup.find("meta", property="og:image")
-        if og_image and og_image.get("content"):
-            image_url = og_image.get("content")
+@app.after_request
+def finish_instrumentation(response):
+    recorder = g.pop("recorder", None)
+    if recorder is not None:
+        instrumentation.stop()
+        response.headers["Server-Timing"] = instrumentation.server_timing(recorder)
+        instrumentation.record_request(recorder, request.endpoint)
+        if instrumentation.should_log(recorder, app.config["SLOW_REQUEST_MS"], app.config["SLOW_REQUEST_SAMPLE"]):
+            print(instrumentation.slow_request_log(recorder, request.method, request.full_path.rstrip("?")))
 
-            return urljoin(url, image_url)
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        body, mimetype = profiler.report()
+        response = make_response(body)
+        response.mimetype = mimetype
+        response.headers["Cache-Control"] = "no-store"
+    return response
 
-        favicon = soup.find("link", rel="icon")
-        if favicon and favicon.get("href"):
-            return urljoin(url, favicon.get("href"))
 
-    except Exception as e:
-        print(f"DEBUG: Failed to get link preview for {url}. Error: {e}")
-        return ""
-    return ""
+template_rendered.connect(instrumentation.template_finished, app)
+before_render_template.connect(instrumentation.template_started, app)
+
+
+_background_jobs_lock = threading.Lock()
+_background_jobs_started = False
 
 
-# Routes
 @app.before_request
-def before_request():
-    init_db()
+def start_background_jobs():
+    # Started from the first request rather than at import so CLI commands
+    # don't spawn threads; test clients never start them. The first requests
+    # can arrive on several threads at once, hence the lock.
+    global _background_jobs_started
+    if app.testing or _background_jobs_started:
+        return
+    with _background_jobs_lock:
+        if _background_jobs_started:
+            return
+        leaderboards.start_refresher(app.config["DATABASE"], ALLOWED_EMOJIS, app.config["LEADERBOARD_MAX_AGE"])
+        cleanup.start_collector(app.config["DATABASE"], app.config["STORAGE"])
+        trending.start_ager(app.config["DATABASE"])
+        _background_jobs_started = True
 
 
 @app.route("/")
+@cached_page(guest_cache=True)
 def index():
     me = current_user()
     if me:
@@ -234,15 +483,14 @@ def index():
 
     # If not logged in, show them the "Public Discovery" feed
     db = get_db()
-    posts = db.execute("""
-        SELECT posts.*, users.username, users.profile_image 
-        FROM posts 
-        JOIN users ON posts.user_id = users.id 
-        ORDER BY posts.timestamp DESC LIMIT 10
-    """).fetchall()
+    rows, next_cursor = keyset_page(db, "SELECT id, timestamp FROM posts WHERE deleted_at IS NULL", (),
+                                    ("timestamp", "id"), request.args.get("before"), GUEST_PAGE_SIZE)
+    # Guest cards show no reaction counts.
+    posts = load_posts(db, [row["id"] for row in rows], emojis=())
 
     # We pass None for user so the template knows we are guests
-    return render_template("index.html", posts=posts, user=None)
+    return render_post_list("index.html", posts, next_cursor, user=None,
+                            card_template="guest_post_card_template.html")
 
 
 @app.route("/register", methods=["GET", "POST"])
@@ -269,12 +517,12 @@ def register():
         # Pick a random emoji to be their default "avatar"
         default_emoji = random.choice(ALLOWED_EMOJIS)
 
-        db.execute("INSERT INTO users (username, password, profile_image) VALUES (?, ?, ?)",
-                   (username, generate_password_hash(password), default_emoji))
+        user_id = dal.get(db).create_user(db, username, generate_password_hash(password), default_emoji)
         db.commit()
+        users.invalidate(user_id)
         flash("Registered — please log in.")
         return redirect("/login")
-    except sqlite3.IntegrityError:
+    except dal.UsernameTaken:
         flash("Username already taken.")
         return redirect("/register")
 
@@ -287,7 +535,7 @@ def login():
     username = request.form.get("username", "").strip()
     password = request.form.get("password", "")
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    user = dal.get(db).user_by_username(db, username)
 
     if user and check_password_hash(user["password"], password):
         session["user_id"] = user["id"]
@@ -316,78 +564,52 @@ def edit_profile():
         image = request.files.get("image")
         filename = user["profile_image"]
 
+        upload = None
         if image and image.filename:
-            saved = save_image(image, resize_to=400)
-            if saved:
-                filename = saved
+            try:
+                upload = save_image(image)
+            except uploads.UploadTooLarge as e:
+                flash(str(e))
+                return redirect(url_for("edit_profile"))
+            if upload:
+                filename = upload.url
 
-        db = get_db()
-        db.execute("UPDATE users SET bio = ?, profile_image = ? WHERE id = ?",
-                   (bio, filename, user["id"]))
-        db.commit()
+        try:
+            write(mutations.update_profile, user["id"], bio, filename)
+        except Exception:
+            if upload:
+                uploads.discard(upload)
+            raise
+        if upload:
+            finish_upload(upload, "profile")
+        users.invalidate(user["id"])
         return redirect(url_for("user_profile", username=user["username"]))
 
     return render_template("edit_profile.html", user=user)
 
 
 @app.route("/user/<username>")
+@cached_page()
 def user_profile(username):
     db = get_db()
-    profile = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    profile = dal.get(db).user_by_username(db, username)
     if not profile:
         return "User not found", 404
 
     me = current_user()
-    is_following = False
-    if me:
-        q = db.execute("SELECT 1 FROM follows WHERE follower_id = ? AND followed_id = ?",
-                       (me["id"], profile["id"])).fetchone()
-        is_following = bool(q)
-
-    posts = db.execute("""
-        SELECT 
-            posts.*, 
-            users.username, 
-            users.profile_image,
-            -- Get the user's specific reaction if it exists
-            (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-            -- Get the top 3 most common reactions
-            (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-             FROM (SELECT reaction_emoji, COUNT(*) as reaction_count 
-                   FROM post_smiles 
-                   WHERE post_id = posts.id 
-                   GROUP BY reaction_emoji 
-                   ORDER BY reaction_count DESC 
-                   LIMIT 3)
-            ) as top_reactions
-        FROM posts
-        JOIN users ON posts.user_id = users.id
-        WHERE posts.user_id = ?
-        ORDER BY posts.timestamp DESC
-    """, (me["id"] if me else 0, profile["id"])).fetchall()
-
-    processed_posts = []
-    for post in posts:
-        post_dict = dict(post)
-        reaction_counts = {emoji: 0 for emoji in ALLOWED_EMOJIS}
-
-        if post_dict['top_reactions']:
-            for item in post_dict['top_reactions'].split(','):
-                try:
-                    emoji, count = item.split(':')
-                    reaction_counts[emoji] = int(count)
-                except ValueError:
-                    continue
-
-        post_dict['reaction_counts_dict'] = reaction_counts
-        processed_posts.append(post_dict)
-
-    return render_template("profile.html",
-                           profile=profile,
-                           posts=processed_posts,
-                           user=me,
-                           is_following=is_following,
-                           allowed_emojis=ALLOWED_EMOJIS)
+    is_following = bool(me) and dal.get(db).is_following(db, me["id"], profile["id"])
+
+    rows, next_cursor = keyset_page(db, """
+        SELECT id, timestamp FROM posts WHERE user_id = ? AND deleted_at IS NULL
+    """, (profile["id"],), ("timestamp", "id"), request.args.get("before"), FEED_PAGE_SIZE)
+
+    processed_posts = load_posts(db, [row["id"] for row in rows], me)
+
+    return render_post_list("profile.html", processed_posts, next_cursor,
+                            profile=profile,
+                            user=me,
+                            is_following=is_following,
+                            allowed_emojis=ALLOWED_EMOJIS)
 
 
 @app.route("/follow/<int:user_id>", methods=["POST"])
@@ -396,10 +618,7 @@ def follow(user_id):
     if not me:
         return redirect("/login")
 
-    db = get_db()
-    db.execute("INSERT OR IGNORE INTO follows (follower_id, followed_id) VALUES (?, ?)",
-               (me["id"], user_id))
-    db.commit()
+    write(mutations.follow, me["id"], user_id)
 
     return redirect(get_safe_redirect(request.referrer))
 
@@ -410,10 +629,7 @@ def unfollow(user_id):
     if not me:
         return redirect("/login")
 
-    db = get_db()
-    db.execute("DELETE FROM follows WHERE follower_id = ? AND followed_id = ?",
-               (me["id"], user_id))
-    db.commit()
+    write(mutations.unfollow, me["id"], user_id)
 
     return redirect(get_safe_redirect(request.referrer))
 
@@ -442,19 +658,39 @@ def create_post():
             return redirect("/post")
 
     image_path = ""
+    fetch_preview = False
+    upload = None
 
+    db = get_db()
     if has_image:
-        image_path = save_image(image_file)
+        try:
+            upload = save_image(image_file)
+        except uploads.UploadTooLarge as e:
+            flash(str(e))
+            return redirect("/post")
+        if upload:
+            image_path = upload.url
 
     elif link:
-        image_path = get_link_preview_image(link)
+        # Cached previews are used right away; anything else is fetched in
+        # the background and filled in once it arrives.
+        cached = link_previews.cached_image(db, link)
+        if cached is None:
+            fetch_preview = True
+        else:
+            image_path = cached
 
-    db = get_db()
-    db.execute(
-        "INSERT INTO posts (user_id, content, image, link) VALUES (?, ?, ?, ?)",
-        (me["id"], content, image_path, link)
-    )
-    db.commit()
+    try:
+        post_id = write(mutations.create_post, me["id"], content, image_path, link)
+    except Exception:
+        if upload:
+            uploads.discard(upload)
+        raise
+    if upload:
+        finish_upload(upload)
+
+    if fetch_preview:
+        link_previews.schedule(app.config["DATABASE"], post_id, link)
 
     flash("Your post has been shared!")
     return redirect(url_for('feed'))
@@ -465,13 +701,7 @@ def delete_post(post_id):
     if not me:
         return redirect(url_for('login'))
 
-    db = get_db()
-    post = db.execute("SELECT user_id FROM posts WHERE id = ?", (post_id,)).fetchone()
-
-    if post and post["user_id"] == me["id"]:
-        db.execute("DELETE FROM post_smiles WHERE post_id = ?", (post_id,))
-        db.execute("DELETE FROM posts WHERE id = ?", (post_id,))
-        db.commit()
+    if write(mutations.delete_post, post_id, me["id"]):
         flash("Post deleted.")
     else:
         flash("You don't have permission to delete this.")
@@ -479,90 +709,75 @@ def delete_post(post_id):
     return redirect(get_safe_redirect(request.referrer))
 
 
+def wants_json():
+    return request.accept_mimetypes.best == "application/json"
+
+
 @app.route('/smile/<int:post_id>', methods=['POST'])
 def smile(post_id):
+    """
+    Form posts get redirected back; the reaction script in base.html asks
+    for JSON and gets just the post's new counts.
+    """
     me = current_user()
     if not me:
+        if wants_json():
+            return jsonify(error="login required"), 401
         return redirect(url_for('login'))
 
     reaction = request.form.get("reaction", "😊")
-
-    db = get_db()
-
-    existing = db.execute("SELECT 1 FROM post_smiles WHERE user_id = ? AND post_id = ?",
-                          (me["id"], post_id)).fetchone()
-
-
     if reaction not in ALLOWED_EMOJIS:
         reaction = "😊"
 
-    if not existing:
-        db.execute("INSERT INTO post_smiles (user_id, post_id, reaction_emoji) VALUES (?, ?, ?)",
-                   (me["id"], post_id, reaction))
-        db.execute("UPDATE posts SET smiles = smiles + 1 WHERE id = ?", (post_id,))
-        db.commit()
-    else:
-        db.execute("UPDATE post_smiles SET reaction_emoji = ? WHERE user_id = ? AND post_id = ?",
-                   (reaction, me["id"], post_id))
-        db.commit()
+    version, counts = write(mutations.smile, me["id"], post_id, reaction, ALLOWED_EMOJIS)
+    if version is not None:
+        live.publish(post_id, version, counts)
 
+    if wants_json():
+        if version is None:
+            return jsonify(error="post not found"), 404
+        return jsonify(post_id=post_id, version=version, counts=counts, user_reaction=reaction)
     return redirect(get_safe_redirect(request.referrer))
 
 
+@app.route("/live/reactions")
+def live_reactions():
+    """Server-Sent Events stream of reaction counts for ?posts=1,2,3."""
+    post_ids = {int(part) for part in request.args.get("posts", "").split(",") if part.isdigit()}
+    if not post_ids:
+        abort(400)
+    subscription = live.subscribe(post_ids)
+    return Response(live.event_stream(subscription), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.route("/feed")
+@cached_page()
 def feed():
     me = current_user()
     if not me:
         return redirect("/login")
     db = get_db()
 
-    posts = db.execute("""
-        SELECT posts.*, users.username, users.profile_image,
-            (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-            (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-             FROM (SELECT reaction_emoji, COUNT(*) as reaction_count FROM post_smiles WHERE post_id = posts.id GROUP BY reaction_emoji ORDER BY reaction_count DESC LIMIT 3)
-            ) as top_reactions
-        FROM posts
-        JOIN users ON posts.user_id = users.id
-        JOIN follows ON posts.user_id = follows.followed_id
-        WHERE follows.follower_id = ?
-        ORDER BY posts.timestamp DESC
-    """, (me["id"], me["id"])).fetchall()
+    before = request.args.get("before")
+    rows, next_cursor = dal.get(db).timeline_page(db, me["id"], before, FEED_PAGE_SIZE)
+    post_ids = [row["timeline_id"] for row in rows]
 
     title = "Following Feed"
 
-    if not posts:
+    # A malformed cursor also gets the first page, so check it decoded.
+    if not post_ids and decode_cursor(before, 2) is None:
         title = "Discovery Feed"
-        posts = db.execute("""
-            SELECT posts.*, users.username, users.profile_image,
-                (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-                (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-                 FROM (SELECT reaction_emoji, COUNT(*) as reaction_count FROM post_smiles WHERE post_id = posts.id GROUP BY reaction_emoji ORDER BY reaction_count DESC LIMIT 3)
-                ) as top_reactions
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            ORDER BY posts.timestamp DESC
-            LIMIT 50
-        """, (me["id"] if me else 0,)).fetchall()
-
-    processed_posts = []
-    for post in posts:
-        post_dict = dict(post)
-        reaction_counts = {emoji: 0 for emoji in ALLOWED_EMOJIS}
-        if post_dict.get('top_reactions'):
-            for item in post_dict['top_reactions'].split(','):
-                try:
-                    emoji, count = item.split(':')
-                    reaction_counts[emoji] = int(count)
-                except (ValueError, KeyError):
-                    continue
-        post_dict['reaction_counts_dict'] = reaction_counts
-        processed_posts.append(post_dict)
-
-    return render_template("feed.html", posts=processed_posts, user=me, title=title, allowed_emojis=ALLOWED_EMOJIS)
+        post_ids = dal.get(db).discovery_feed(db)
+
+    processed_posts = load_posts(db, post_ids, me)
+
+    return render_post_list("feed.html", processed_posts, next_cursor, user=me, title=title,
+                            allowed_emojis=ALLOWED_EMOJIS)
 
 
 @app.route("/top")
+@cached_page(guest_cache=True)
 def top():
     user = current_user()
     user_id = user["id"] if user else 0
@@ -571,70 +786,34 @@ def top():
     filter_emoji = request.args.get('filter', 'all')
     if filter_emoji not in ['all', 'combo'] + ALLOWED_EMOJIS:
         filter_emoji = 'all'
+    if request.args.get('sort') == 'hot':
+        filter_emoji = 'hot'
 
     # --- SQL DATA FETCHING ---
-    if filter_emoji == 'all':
-        posts = db.execute("""
-            SELECT posts.*, users.username, users.profile_image,
-                (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-                (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-                 FROM (SELECT reaction_emoji, COUNT(*) as reaction_count FROM post_smiles WHERE post_id = posts.id GROUP BY reaction_emoji ORDER BY reaction_count DESC LIMIT 3)
-                ) as top_reactions
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            ORDER BY posts.smiles DESC, posts.timestamp DESC LIMIT 100
-        """, (user_id,)).fetchall()
-    elif filter_emoji == 'combo':
-        posts = db.execute("""
-            SELECT posts.*, users.username, users.profile_image,
-                (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-                (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-                 FROM (SELECT reaction_emoji, COUNT(*) as reaction_count FROM post_smiles WHERE post_id = posts.id GROUP BY reaction_emoji ORDER BY reaction_count DESC LIMIT 3)
-                ) as top_reactions,
-                (SELECT COUNT(DISTINCT reaction_emoji) FROM post_smiles WHERE post_id = posts.id) as emoji_diversity
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            WHERE posts.id IN (
-                SELECT post_id FROM post_smiles GROUP BY post_id HAVING COUNT(DISTINCT reaction_emoji) >= 3
-            )
-            ORDER BY emoji_diversity DESC, posts.smiles DESC, posts.timestamp DESC LIMIT 100
-        """, (user_id,)).fetchall()
+    # Rankings come precomputed from the leaderboard store (or the trending
+    # scores); the posts on the page are loaded afterwards, with the viewer's
+    # own reactions.
+    if filter_emoji == 'hot':
+        rows, next_cursor = trending.page(db, request.args.get("before"), FEED_PAGE_SIZE)
+        post_ids = [row["hot_post_id"] for row in rows]
     else:
-        # Corrected binding: 2 question marks match 2 variables
-        posts = db.execute("""
-                SELECT posts.*, users.username, users.profile_image,
-                    (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-                    (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-                     FROM (SELECT reaction_emoji, COUNT(*) as reaction_count FROM post_smiles WHERE post_id = posts.id GROUP BY reaction_emoji ORDER BY reaction_count DESC LIMIT 3)
-                    ) as top_reactions,
-                    (SELECT COUNT(*) FROM post_smiles WHERE post_id = posts.id AND reaction_emoji = ?) as specific_emoji_count
-                FROM posts
-                JOIN users ON posts.user_id = users.id
-                ORDER BY specific_emoji_count DESC, posts.smiles DESC, posts.timestamp DESC LIMIT 100
-            """, (user_id, filter_emoji)).fetchall()
+        rows, next_cursor = keyset_page(db, """
+            SELECT score AS board_score, smiles AS board_smiles, timestamp AS board_timestamp, post_id AS board_post_id
+            FROM leaderboard_entries
+            WHERE board = ?
+        """, (filter_emoji,), ("board_score", "board_smiles", "board_timestamp", "board_post_id"),
+            request.args.get("before"), FEED_PAGE_SIZE)
+        post_ids = [row["board_post_id"] for row in rows]
 
     # --- DATA PROCESSING ---
-    processed_posts = []
-    for post in posts:
-        post_dict = dict(post)
-        reaction_counts = {emoji: 0 for emoji in ALLOWED_EMOJIS}
-        if post_dict['top_reactions']:
-            for item in post_dict['top_reactions'].split(','):
-                try:
-                    emoji, count = item.split(':')
-                    reaction_counts[emoji] = int(count)
-                except ValueError:
-                    continue
-        post_dict['reaction_counts_dict'] = reaction_counts
-        processed_posts.append(post_dict)
+    processed_posts = load_posts(db, post_ids, user)
+
+    if request.args.get("fragment"):
+        return render_post_list("top.html", processed_posts, next_cursor, user=user,
+                                allowed_emojis=ALLOWED_EMOJIS, wrap_cards=True)
 
     # --- SIDEBAR & VIBE CALCULATIONS ---
-    emoji_stats = db.execute("""
-        SELECT reaction_emoji, COUNT(*) as count FROM post_smiles
-        WHERE post_id IN (SELECT id FROM posts WHERE timestamp > datetime('now', '-7 days'))
-        GROUP BY reaction_emoji ORDER BY count DESC
-    """).fetchall()
-    leaderboard = [{'emoji': row['reaction_emoji'], 'count': row['count']} for row in emoji_stats]
+    leaderboard = [{'emoji': row['emoji'], 'count': row['count']} for row in leaderboards.weekly_totals(db)]
 
     # Recent Vibe (Top global emoji)
     recent_vibe = leaderboard[0]['emoji'] if leaderboard else "✨"
@@ -665,68 +844,32 @@ def top():
         '🥳': {'name': 'Celebration Central', 'description': 'Victories worth celebrating'}
     }
 
-    if filter_emoji == 'combo':
+    if filter_emoji == 'hot':
+        current_category = {'name': 'Trending Now', 'description': 'What everyone is smiling at right now'}
+    elif filter_emoji == 'combo':
         current_category = {'name': 'Universally Loved', 'description': 'Posts that sparked joy in all kinds of ways'}
     elif filter_emoji == 'all':
         current_category = {'name': 'All Top Posts', 'description': 'The most uplifting stories from our community'}
     else:
         current_category = emoji_categories.get(filter_emoji, {'name': 'Top Posts', 'description': 'Uplifting stories'})
 
-    return render_template("top.html", posts=processed_posts, user=user, title="Top Posts",
-                           allowed_emojis=ALLOWED_EMOJIS, filter_emoji=filter_emoji,
-                           emoji_categories=emoji_categories, current_category=current_category,
-                           leaderboard=leaderboard, personal_stats=personal_stats,
-                           recent_vibe=recent_vibe, personal_vibe=personal_vibe)
+    return render_post_list("top.html", processed_posts, next_cursor, user=user, title="Top Posts", wrap_cards=True,
+                            allowed_emojis=ALLOWED_EMOJIS, filter_emoji=filter_emoji,
+                            emoji_categories=emoji_categories, current_category=current_category,
+                            leaderboard=leaderboard, personal_stats=personal_stats,
+                            recent_vibe=recent_vibe, personal_vibe=personal_vibe)
 
 @app.route('/view/<int:post_id>')
+@cached_page()
 def view_single_post(post_id):
     me = current_user()
     db = get_db()
 
-    post = db.execute("""
-        SELECT 
-            posts.*, 
-            users.username, 
-            users.profile_image,
-            -- Get the user's specific reaction if it exists
-            (SELECT reaction_emoji FROM post_smiles WHERE post_smiles.post_id = posts.id AND post_smiles.user_id = ?) as user_reaction,
-            -- Get the top 3 most common reactions and their counts for display
-            (SELECT GROUP_CONCAT(reaction_emoji || ':' || reaction_count) 
-             FROM (SELECT reaction_emoji, COUNT(*) as reaction_count 
-                   FROM post_smiles 
-                   WHERE post_id = posts.id 
-                   GROUP BY reaction_emoji 
-                   ORDER BY reaction_count DESC 
-                   LIMIT 3)
-            ) as top_reactions
-        FROM posts
-        JOIN users ON posts.user_id = users.id
-        WHERE posts.id = ?
-    """, (me["id"] if me else 0, post_id)).fetchone()
-
-    if not post:
+    prepared = load_posts(db, [post_id], me)
+    if not prepared:
         return "Post not found", 404
 
-    posts_to_process = [post]
-    processed_posts = []
-
-    for post_row in posts_to_process:
-        post_dict = dict(post_row)
-
-        reaction_counts = {emoji: 0 for emoji in ALLOWED_EMOJIS}
-
-        if post_dict['top_reactions']:
-            for item in post_dict['top_reactions'].split(','):
-                try:
-                    emoji, count = item.split(':')
-                    reaction_counts[emoji] = int(count)
-                except ValueError:
-                    continue
-
-        post_dict['reaction_counts_dict'] = reaction_counts
-        processed_posts.append(post_dict)
-
-    post_data = processed_posts[0]
+    post_data = prepared[0]
 
     return render_template('post_view.html', post=post_data, user=me, title=f"Post by {post_data['username']}",
                            allowed_emojis=ALLOWED_EMOJIS)
@@ -734,15 +877,17 @@ def view_single_post(post_id):
 @app.route("/search")
 def search():
     query = request.args.get("q", "").strip()
-    users = []
+    me = current_user()
+    found_users, posts, next_cursor = [], [], None
     if query:
         db = get_db()
-        users = db.execute(
-            "SELECT id, username, profile_image FROM users WHERE username LIKE ?",
-            (f"%{query}%",)
-        ).fetchall()
+        rows, next_cursor = search_index.post_page(db, query, request.args.get("before"), FEED_PAGE_SIZE)
+        posts = load_posts(db, [row["search_id"] for row in rows], me)
+        if not request.args.get("before"):
+            found_users = search_index.users(db, query)
 
-    return render_template("search_results.html", users=users, query=query, user=current_user())
+    return render_post_list("search_results.html", posts, next_cursor, users=found_users, query=query,
+                            user=me, allowed_emojis=ALLOWED_EMOJIS)
 
 @app.route("/forgot-password", methods=["GET", "POST"])
 def forgot_password():
@@ -760,18 +905,48 @@ def forgot_password():
         return redirect(url_for("forgot_password"))
 
     db = get_db()
-    user = db.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+    user = dal.get(db).user_by_username(db, username)
 
     if user:
-        db.execute("UPDATE users SET password = ? WHERE id = ?",
-                   (generate_password_hash(new_password), user["id"]))
+        dal.get(db).set_password(db, user["id"], generate_password_hash(new_password))
         db.commit()
+        users.invalidate(user["id"])
         flash("Password reset successful! Please log in.")
         return redirect(url_for("login"))
     else:
         flash("Username not found.")
         return redirect(url_for("forgot_password"))
 
+@app.route("/_debug/db-pool")
+def debug_db_pool():
+    if not app.config["DEBUG_ENDPOINTS"]:
+        abort(404)
+    return jsonify(db_pool.stats())
+
+
+@app.route("/_debug/metrics")
+def debug_metrics():
+    if not app.config["DEBUG_ENDPOINTS"]:
+        abort(404)
+    gauges = {
+        "db_pool": db_pool.stats(),
+        "writer": writer.stats(),
+        "user_cache": users.stats(),
+        "card_cache": fragments.stats(),
+        "guest_page_cache": http_cache.stats(),
+        "live": live.stats(),
+        "cleanup": cleanup.stats(),
+    }
+    return Response(instrumentation.exposition(gauges), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/_debug/gc")
+def debug_gc():
+    if not app.config["DEBUG_ENDPOINTS"]:
+        abort(404)
+    return jsonify(backlog=cleanup.backlog(get_db()), collected=cleanup.stats())
+
+
 # Error Handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -786,9 +961,32 @@ from flask import send_from_directory
 
 @app.route('/uploads/<path:filename>')
 def serve_uploads(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    store = app.config["STORAGE"]
+    if filename.startswith(".") or "/" in filename:
+        abort(404)
+
+    public_url = store.public_url(filename)
+    if public_url:
+        return redirect(public_url)
+
+    try:
+        body, _ = store.open(filename)
+    except FileNotFoundError:
+        abort(404)
+
+    # Uploads are named after their content and never rewritten (see images.py).
+    if isinstance(store, storage.LocalStorage):
+        body.close()
+        response = send_from_directory(store.folder, filename, max_age=http_cache.UPLOAD_MAX_AGE)
+    else:
+        response = Response(iter(lambda: body.read(uploads.CHUNK_SIZE), b""),
+                            mimetype=storage.content_type(filename))
+        response.call_on_close(body.close)
+
+    response.cache_control.max_age = http_cache.UPLOAD_MAX_AGE
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == "__main__":
-    with app.app_context():
-        init_db()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,352 @@
+"""
+Versioned schema migrations for chrpi.db.
+
+The current schema version lives in SQLite's own `PRAGMA user_version`, so
+an up-to-date database costs a single pragma read at startup. Each entry in
+MIGRATIONS is applied once, in order, inside its own transaction.
+"""
+
+
+def _initial_schema(db):
+    # Users Table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        bio TEXT DEFAULT '',
+        profile_image TEXT DEFAULT ''
+    );
+    """)
+
+    # Posts Table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        content TEXT NOT NULL,
+        image TEXT DEFAULT '',
+        link TEXT DEFAULT '',
+        smiles INTEGER DEFAULT 0,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+    """)
+
+    # Follows Table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS follows (
+        follower_id INTEGER,
+        followed_id INTEGER,
+        UNIQUE (follower_id, followed_id)
+    );
+    """)
+
+    # Post Smiles Table
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS post_smiles (
+        user_id INTEGER,
+        post_id INTEGER,
+        reaction_emoji TEXT DEFAULT '😊', -- NEW: Store the specific emoji here
+        UNIQUE (user_id, post_id)
+    );
+    """)
+
+
+def _feed_indexes(db):
+    # Per-post reaction lookups (top reactions, combo and emoji filters).
+    db.execute("CREATE INDEX IF NOT EXISTS idx_post_smiles_post_emoji ON post_smiles (post_id, reaction_emoji)")
+    # Profile pages and the Following feed.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_timestamp ON posts (user_id, timestamp)")
+    # /top ordering.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_smiles_timestamp ON posts (smiles, timestamp)")
+    # Guest index, Discovery feed and the 7-day sidebar window.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON posts (timestamp)")
+    # Follower lookups.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_follows_followed ON follows (followed_id)")
+
+
+def _reaction_counts(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS post_reaction_counts (
+        post_id INTEGER NOT NULL,
+        emoji TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (post_id, emoji)
+    ) WITHOUT ROWID;
+    """)
+    db.execute("""
+    INSERT INTO post_reaction_counts (post_id, emoji, count)
+    SELECT post_id, reaction_emoji, COUNT(*) FROM post_smiles GROUP BY post_id, reaction_emoji
+    """)
+
+
+def _home_timeline(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS home_timeline (
+        user_id INTEGER NOT NULL,
+        timestamp DATETIME NOT NULL,
+        post_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, timestamp, post_id)
+    ) WITHOUT ROWID;
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_home_timeline_post ON home_timeline (post_id)")
+    db.execute("""
+    INSERT OR IGNORE INTO home_timeline (user_id, timestamp, post_id)
+    SELECT follows.follower_id, posts.timestamp, posts.id
+    FROM follows JOIN posts ON posts.user_id = follows.followed_id
+    """)
+
+
+def _leaderboards(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS leaderboard_entries (
+        board TEXT NOT NULL,
+        post_id INTEGER NOT NULL,
+        score INTEGER NOT NULL,
+        smiles INTEGER NOT NULL,
+        timestamp DATETIME NOT NULL,
+        PRIMARY KEY (board, post_id)
+    ) WITHOUT ROWID;
+    """)
+    db.execute("""
+    CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_rank
+    ON leaderboard_entries (board, score, smiles, timestamp, post_id)
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_post ON leaderboard_entries (post_id)")
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS weekly_reactions (
+        emoji TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS leaderboard_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        refreshed_at REAL
+    );
+    """)
+
+
+def _link_previews(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS link_previews (
+        url TEXT PRIMARY KEY,
+        image TEXT NOT NULL DEFAULT '',
+        fetched_at REAL NOT NULL
+    );
+    """)
+
+
+def _image_derivatives(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS image_derivatives (
+        image TEXT NOT NULL,
+        format TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        PRIMARY KEY (image, format, width)
+    ) WITHOUT ROWID;
+    """)
+
+
+def _post_versions(db):
+    # Bumped whenever a post's rendered card changes; keys the fragment cache.
+    db.execute("ALTER TABLE posts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def _search_index(db):
+    db.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, content='users', content_rowid='id', tokenize='trigram'
+    );
+    """)
+    db.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        content, content='posts', content_rowid='id', prefix='2 3'
+    );
+    """)
+
+    # External-content tables don't follow their base table on their own.
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+    END;
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+    END;
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+        INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+    END;
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF content ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO posts_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    """)
+
+    db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    db.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+
+
+def _content_version(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS content_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    """)
+    db.execute("INSERT OR IGNORE INTO content_version (id, version) VALUES (1, 0)")
+
+    # Everything a post list shows; see http_cache.py.
+    watched = [
+        ("posts", "INSERT", "insert"), ("posts", "UPDATE", "update"), ("posts", "DELETE", "delete"),
+        ("follows", "INSERT", "insert"), ("follows", "DELETE", "delete"),
+        ("users", "UPDATE OF username, bio, profile_image", "update"),
+        ("image_derivatives", "INSERT", "insert"),
+        ("leaderboard_meta", "INSERT", "insert"), ("leaderboard_meta", "UPDATE", "update"),
+    ]
+    for table, event, name in watched:
+        db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_content_version_{name} AFTER {event} ON {table} BEGIN
+            UPDATE content_version SET version = version + 1 WHERE id = 1;
+        END;
+        """)
+
+
+def _blobs(db):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        name TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL,
+        released_at REAL
+    ) WITHOUT ROWID;
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_blobs_released ON blobs (released_at) WHERE refs <= 0")
+    # Existing uploads keep their uuid names; count who uses each one.
+    db.execute("""
+    INSERT OR IGNORE INTO blobs (name, refs)
+    SELECT substr(image, length('/uploads/') + 1), COUNT(*) FROM (
+        SELECT image FROM posts UNION ALL SELECT profile_image FROM users
+    )
+    WHERE image LIKE '/uploads/%'
+    GROUP BY image
+    """)
+
+
+def _post_tombstones(db):
+    # Set when a post is deleted; cleanup.py purges its rows in the background.
+    db.execute("ALTER TABLE posts ADD COLUMN deleted_at REAL")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_deleted ON posts (deleted_at) WHERE deleted_at IS NOT NULL")
+
+
+def _trending(db):
+    # Log-scaled, time-decayed scores for /top?sort=hot; see trending.py.
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS post_trending (
+        post_id INTEGER PRIMARY KEY,
+        score REAL NOT NULL
+    );
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_post_trending_score ON post_trending (score, post_id)")
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS trending_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        aged_at REAL NOT NULL
+    );
+    """)
+    # Aging drops posts from the hot list, so it changes what /top shows.
+    for event, name in (("INSERT", "insert"), ("UPDATE", "update")):
+        db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trending_meta_content_version_{name} AFTER {event} ON trending_meta BEGIN
+            UPDATE content_version SET version = version + 1 WHERE id = 1;
+        END;
+        """)
+
+
+def _processed_uploads(db):
+    # images.process() stores its output under a new name and repoints the
+    # rows; this remembers the result so a re-upload isn't processed again.
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS processed_uploads (
+        original TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        processed TEXT NOT NULL,
+        PRIMARY KEY (original, kind)
+    ) WITHOUT ROWID;
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_processed_uploads_processed ON processed_uploads (processed)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_image ON posts (image)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_profile_image ON users (profile_image)")
+
+
+# Ordered list of (version, description, upgrade function). Append only:
+# never edit or reorder a step that has already shipped.
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "secondary indexes for feed queries", _feed_indexes),
+    (3, "materialized per-post reaction counts", _reaction_counts),
+    (4, "fan-out-on-write home timelines", _home_timeline),
+    (5, "precomputed /top leaderboards", _leaderboards),
+    (6, "link preview cache", _link_previews),
+    (7, "resized image derivatives", _image_derivatives),
+    (8, "post versions for the card cache", _post_versions),
+    (9, "full-text search indexes", _search_index),
+    (10, "content version for HTTP caching", _content_version),
+    (11, "upload blob reference counts", _blobs),
+    (12, "soft-deleted posts", _post_tombstones),
+    (13, "time-decayed trending scores", _trending),
+    (14, "processed uploads under their own names", _processed_uploads),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db, target=LATEST_VERSION):
+    """
+    Applies every pending migration up to `target`.
+    Returns the list of versions that were applied.
+    """
+    current = get_version(db)
+    applied = []
+
+    for version, description, upgrade in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker booting at the same time may have won the race.
+            if get_version(db) >= version:
+                db.rollback()
+                continue
+            upgrade(db)
+            # PRAGMA does not accept bound parameters; version is always an int.
+            db.execute(f"PRAGMA user_version = {int(version)}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+
+    return applied
@@ -0,0 +1,76 @@
+"""
+Write operations run by the single writer (see writer.py).
+
+Each takes the writer's connection as its first argument and runs inside the
+writer's transaction, so none of them begin or commit on their own.
+"""
+import time
+
+import dal
+import leaderboards
+import timeline
+import trending
+import uploads
+
+
+def smile(db, user_id, post_id, emoji, emojis=()):
+    """
+    Records the reaction. Returns (version, counts) for the post as of this
+    write, counts as in reactions.reaction_counts(); version is None (and
+    nothing is recorded) if the post doesn't exist or was deleted.
+    """
+    if not db.execute("SELECT 1 FROM posts WHERE id = ? AND deleted_at IS NULL", (post_id,)).fetchone():
+        return None, {}
+    previous = dal.get(db).record_reaction(db, user_id, post_id, emoji)
+    if previous != emoji:
+        bump_version(db, post_id)
+    if previous is None:
+        trending.record(db, post_id)
+    leaderboards.apply_reaction(db, post_id, previous, emoji)
+
+    version = db.execute("SELECT version FROM posts WHERE id = ?", (post_id,)).fetchone()[0]
+    return version, dal.get(db).reaction_counts(db, [post_id], emojis)[post_id]
+
+
+def bump_version(db, post_id):
+    """Marks `post_id`'s cached card as stale (see fragments.py)."""
+    db.execute("UPDATE posts SET version = version + 1 WHERE id = ?", (post_id,))
+
+
+def follow(db, follower_id, followed_id):
+    dal.get(db).follow(db, follower_id, followed_id)
+
+
+def unfollow(db, follower_id, followed_id):
+    dal.get(db).unfollow(db, follower_id, followed_id)
+
+
+def create_post(db, user_id, content, image, link):
+    """Returns the new post's id."""
+    post_id = dal.get(db).create_post(db, user_id, content, image, link)
+    uploads.acquire(db, image)
+    return post_id
+
+
+def delete_post(db, post_id, user_id):
+    """
+    Tombstones `post_id` if `user_id` wrote it and takes it off every feed.
+    Returns True if it did. cleanup.py purges its reactions and image later.
+    """
+    post = db.execute("SELECT user_id FROM posts WHERE id = ? AND deleted_at IS NULL", (post_id,)).fetchone()
+    if not post or post["user_id"] != user_id:
+        return False
+
+    db.execute("UPDATE posts SET deleted_at = ? WHERE id = ?", (time.time(), post_id))
+    timeline.remove_post(db, post_id)
+    leaderboards.remove_post(db, post_id)
+    trending.remove_post(db, post_id)
+    return True
+
+
+def update_profile(db, user_id, bio, profile_image):
+    old = db.execute("SELECT profile_image FROM users WHERE id = ?", (user_id,)).fetchone()
+    db.execute("UPDATE users SET bio = ?, profile_image = ? WHERE id = ?", (bio, profile_image, user_id))
+    if old and old["profile_image"] != profile_image:
+        uploads.acquire(db, profile_image)
+        uploads.release(db, old["profile_image"])
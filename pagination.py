@@ -0,0 +1,68 @@
+"""
+Opaque cursors for keyset pagination.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and then
+base64'd so templates can drop it straight into a query string. Keys JSON
+has no type for (PostgreSQL timestamps) travel as their str(), which the
+database casts back when the cursor is bound.
+"""
+import base64
+import json
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """
+    Returns the `size` values packed into `token`, or None if the token is
+    missing or malformed (callers then start from the first page).
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    # Only scalars can be bound as SQL parameters (bool is an int, but not a key).
+    if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+
+def keyset_page(db, sql, params, order_by, before=None, limit=20, placeholder="?"):
+    """
+    Fetches one page of `sql`, ordered by the `order_by` columns descending.
+
+    `sql` is a plain SELECT (no ORDER BY or LIMIT) whose result includes every
+    column in `order_by`, the last of which must be unique. `before` is the
+    cursor from the previous page. One extra row is fetched to learn whether
+    another page exists, so no COUNT query is needed.
+
+    `placeholder` is the driver's parameter marker ("%s" for PostgreSQL).
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    keys = ", ".join(order_by)
+    where = ""
+    params = list(params)
+
+    before = decode_cursor(before, len(order_by))
+    if before:
+        where = f"WHERE ({keys}) < ({', '.join([placeholder] * len(order_by))})"
+        params += before
+
+    order = ", ".join(f"{key} DESC" for key in order_by)
+    rows = db.execute(f"SELECT * FROM ({sql}) AS page {where} ORDER BY {order} LIMIT {placeholder}",
+                      params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*(rows[-1][key] for key in order_by))
+    return rows, next_cursor
@@ -0,0 +1,107 @@
+"""
+Query-plan regression check.
+
+Drives every read route through Flask's test client against a small seeded
+database, captures the SQL each one actually runs, and feeds it to
+`EXPLAIN QUERY PLAN`. Any plan step that walks a whole table without an
+index ("SCAN posts" rather than "SCAN posts USING INDEX ..." or "SEARCH ...")
+is reported as a regression.
+
+Run it with `flask --app main check-query-plans`.
+"""
+import os
+import sqlite3
+import tempfile
+
+import db_pool
+import migrations
+
+
+# Full scans we know about and accept, keyed by (route, table). A route of
+# None accepts the scan on every route.
+KNOWN_SCANS = {
+    (None, "weekly_reactions"): "at most one row per emoji",
+}
+
+READ_ONLY_PREFIXES = ("SELECT", "WITH")
+
+
+def _seed(db):
+    db.execute("INSERT INTO users (id, username, password) VALUES (1, 'alice', 'x'), (2, 'bob', 'x')")
+    db.execute("INSERT INTO posts (id, user_id, content) VALUES (1, 1, 'hello'), (2, 2, 'hi there')")
+    db.execute("INSERT INTO follows (follower_id, followed_id) VALUES (1, 2)")
+    db.execute("INSERT INTO post_smiles (user_id, post_id, reaction_emoji) VALUES (1, 2, '😊'), (2, 1, '😂')")
+    db.commit()
+
+
+def _routes(emojis):
+    routes = ["/", "/feed", "/top", "/top?filter=combo", "/top?sort=hot", "/user/bob", "/view/1", "/login",
+              "/search?q=a", "/search?q=ali", "/search?q=hel"]
+    routes += [f"/top?filter={emoji}" for emoji in emojis]
+    return routes
+
+
+def full_scans(db, sql):
+    """
+    Returns the tables `sql` reads with a full table scan.
+    """
+    tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    scanned = []
+    for row in db.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        detail = row[3]
+        if not detail.startswith("SCAN "):
+            continue
+        words = detail.split()
+        # Virtual tables (the FTS indexes) report their own access path.
+        if words[1] in tables and "USING" not in words and "VIRTUAL" not in words:
+            scanned.append(words[1])
+    return scanned
+
+
+def check(app, emojis):
+    """
+    Returns a list of (route, table, sql) for every unexpected full scan.
+    """
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    original_db = app.config["DATABASE"]
+    original_trace = app.config.get("SQL_TRACE")
+    original_testing = app.testing
+    captured = []
+
+    try:
+        db = sqlite3.connect(db_path)
+        migrations.migrate(db)
+        _seed(db)
+
+        app.config["DATABASE"] = db_path
+        app.config["SQL_TRACE"] = captured.append
+        app.testing = True
+
+        problems = []
+        client = app.test_client()
+        for logged_in in (False, True):
+            with client.session_transaction() as sess:
+                sess.clear()
+                if logged_in:
+                    sess["user_id"] = 1
+
+            for route in _routes(emojis):
+                captured.clear()
+                client.get(route)
+                for sql in captured:
+                    if not sql.lstrip().upper().startswith(READ_ONLY_PREFIXES):
+                        continue
+                    for table in full_scans(db, sql):
+                        if (route, table) not in KNOWN_SCANS and (None, table) not in KNOWN_SCANS:
+                            problems.append((route, table, sql))
+        db.close()
+        return problems
+    finally:
+        app.config["DATABASE"] = original_db
+        app.config["SQL_TRACE"] = original_trace
+        app.testing = original_testing
+        db_pool.discard(db_path)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
@@ -0,0 +1,122 @@
+"""
+Materialized per-post reaction counters.
+
+`post_reaction_counts` holds one row per (post, emoji) with a running count,
+kept in step with `post_smiles` by the write path so feeds never have to
+aggregate raw reactions on read.
+"""
+
+# How many reaction types a post card shows.
+TOP_REACTIONS = 3
+
+
+def record_reaction(db, user_id, post_id, emoji):
+    """
+    Stores `user_id`'s reaction to `post_id` and updates the counters.
+    Changing an existing reaction moves one count from the old emoji to the
+    new one. Runs inside the caller's (the writer's) transaction.
+
+    Returns the emoji this reaction replaced, or None if it is new.
+    """
+    existing = db.execute("SELECT reaction_emoji FROM post_smiles WHERE user_id = ? AND post_id = ?",
+                          (user_id, post_id)).fetchone()
+    previous = existing["reaction_emoji"] if existing else None
+    if previous == emoji:
+        return previous
+
+    db.execute("""
+        INSERT INTO post_smiles (user_id, post_id, reaction_emoji) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, post_id) DO UPDATE SET reaction_emoji = excluded.reaction_emoji
+    """, (user_id, post_id, emoji))
+
+    if previous is None:
+        db.execute("UPDATE posts SET smiles = smiles + 1 WHERE id = ?", (post_id,))
+    else:
+        _bump(db, post_id, previous, -1)
+    _bump(db, post_id, emoji, 1)
+    return previous
+
+
+def _bump(db, post_id, emoji, delta):
+    db.execute("""
+        INSERT INTO post_reaction_counts (post_id, emoji, count) VALUES (?, ?, ?)
+        ON CONFLICT (post_id, emoji) DO UPDATE SET count = count + excluded.count
+    """, (post_id, emoji, delta))
+    if delta < 0:
+        db.execute("DELETE FROM post_reaction_counts WHERE post_id = ? AND emoji = ? AND count <= 0",
+                   (post_id, emoji))
+
+
+def delete_post_counts(db, post_id):
+    """Drops a post's counters. Runs inside the caller's transaction."""
+    db.execute("DELETE FROM post_reaction_counts WHERE post_id = ?", (post_id,))
+
+
+def reaction_counts(db, post_ids, emojis):
+    """
+    Returns {post_id: {emoji: count}} for every id in `post_ids`, with every
+    emoji in `emojis` present. Only each post's TOP_REACTIONS most used
+    emojis carry a non-zero count, matching what the post cards display.
+    """
+    counts = {post_id: {emoji: 0 for emoji in emojis} for post_id in post_ids}
+    if not counts:
+        return counts
+
+    placeholders = ",".join("?" * len(counts))
+    rows = db.execute(f"""
+        SELECT post_id, emoji, count FROM post_reaction_counts
+        WHERE post_id IN ({placeholders})
+        ORDER BY post_id, count DESC, emoji
+    """, list(counts)).fetchall()
+
+    shown = {}
+    for post_id, emoji, count in rows:
+        if emoji not in counts[post_id] or shown.get(post_id, 0) >= TOP_REACTIONS:
+            continue
+        counts[post_id][emoji] = count
+        shown[post_id] = shown.get(post_id, 0) + 1
+    return counts
+
+
+def rebuild_counts(db):
+    """
+    Recomputes every counter from `post_smiles`.
+    Returns how many (post, emoji) counters were wrong or missing.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        drift = db.execute("""
+            WITH actual AS (
+                SELECT post_id, reaction_emoji AS emoji, COUNT(*) AS count
+                FROM post_smiles GROUP BY post_id, reaction_emoji
+            )
+            SELECT COUNT(*) FROM (
+                SELECT post_id, emoji FROM (SELECT * FROM actual EXCEPT SELECT * FROM post_reaction_counts)
+                UNION
+                SELECT post_id, emoji FROM (SELECT * FROM post_reaction_counts EXCEPT SELECT * FROM actual)
+            )
+        """).fetchone()[0]
+
+        # Repaired posts render differently, so their cached cards must go.
+        db.execute("""
+            UPDATE posts SET version = version + 1 WHERE id IN (
+                SELECT post_id FROM post_smiles
+                WHERE NOT EXISTS (SELECT 1 FROM post_reaction_counts AS c
+                                  WHERE c.post_id = post_smiles.post_id AND c.emoji = post_smiles.reaction_emoji)
+                UNION
+                SELECT post_id FROM post_reaction_counts AS c
+                WHERE c.count != (SELECT COUNT(*) FROM post_smiles
+                                  WHERE post_smiles.post_id = c.post_id AND post_smiles.reaction_emoji = c.emoji)
+            )
+        """)
+
+        db.execute("DELETE FROM post_reaction_counts")
+        db.execute("""
+            INSERT INTO post_reaction_counts (post_id, emoji, count)
+            SELECT post_id, reaction_emoji, COUNT(*) FROM post_smiles GROUP BY post_id, reaction_emoji
+        """)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return drift
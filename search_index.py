@@ -0,0 +1,73 @@
+"""
+Full-text search over usernames and post content (SQLite FTS5).
+
+`users_fts` uses the trigram tokenizer, so any 3+ character piece of a
+username matches, as the old LIKE '%query%' did, but from an index. Shorter
+queries still use that LIKE; a scan of the usernames is cheap next to
+rendering the results. `posts_fts`
+tokenizes words with 2- and 3-character prefix indexes, so "sun" finds
+"sunny". Both are external-content tables kept in sync by triggers (see
+migration 9); rebuild() repopulates them from the base tables.
+"""
+import re
+
+from pagination import keyset_page
+
+USER_RESULTS = 20
+TRIGRAM_MIN = 3
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def users(db, query, limit=USER_RESULTS):
+    """Returns up to `limit` users matching `query`, best match first."""
+    if len(query) >= TRIGRAM_MIN:
+        return db.execute("""
+            SELECT users.id, users.username, users.profile_image
+            FROM users_fts
+            JOIN users ON users.id = users_fts.rowid
+            WHERE users_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (_phrase(query), limit)).fetchall()
+
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return db.execute("""
+        SELECT id, username, profile_image FROM users
+        WHERE username LIKE '%' || ? || '%' ESCAPE '\\'
+        ORDER BY username
+        LIMIT ?
+    """, (escaped, limit)).fetchall()
+
+
+def post_page(db, query, before=None, limit=20):
+    """
+    Returns (rows, next_cursor) for one page of posts containing every word
+    of `query` (each as a prefix), ranked by bm25. Each row's `search_id` is
+    a post id, for hydration.load().
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return [], None
+
+    match = " ".join(_phrase(word) + "*" for word in words)
+    return keyset_page(db, """
+        SELECT -posts_fts.rank AS search_score, posts.id AS search_id
+        FROM posts_fts
+        JOIN posts ON posts.id = posts_fts.rowid
+        WHERE posts_fts MATCH ? AND posts.deleted_at IS NULL
+    """, (match,), ("search_score", "search_id"), before, limit)
+
+
+def rebuild(db):
+    """Rebuilds both indexes from `users` and `posts`."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+        db.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
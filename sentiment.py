@@ -0,0 +1,146 @@
+"""
+Sentiment scoring service.
+
+TextBlob's pattern analyzer is pure Python. A single post is scored inline,
+since shipping one short text to another process costs more than scoring
+it; batches of POOL_MIN or more unscored texts (bulk imports, re-moderation
+sweeps) are spread over a process pool whose workers load the lexicon as
+they start. Scores are memoized in a bounded LRU keyed by a hash of the
+whitespace-normalized text, so reposts and sweeps of unchanged posts cost
+a dictionary lookup.
+"""
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Posts at or above this polarity are neutral or positive enough to publish.
+THRESHOLD = -0.1
+
+CACHE_SIZE = 10000
+WORKERS = 2
+BATCH_CHUNK = 64
+# Fewer unscored texts than this are scored in the calling thread.
+POOL_MIN = BATCH_CHUNK
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+_pool = None
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _load_analyzer():
+    """Loads the lexicon, once per process; also the pool workers' initializer."""
+    global _analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            from textblob.en.sentiments import PatternAnalyzer
+            analyzer = PatternAnalyzer()
+            # The lexicon itself is only read on the first analysis.
+            analyzer.analyze("warm up")
+            _analyzer = analyzer
+    return _analyzer
+
+
+def _score(text):
+    return (_analyzer or _load_analyzer()).analyze(text).polarity
+
+
+def _score_many(texts):
+    return [_score(text) for text in texts]
+
+
+def _normalize(text):
+    return " ".join(text.split())
+
+
+def _key(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def _cached(key):
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+
+def _remember(key, score):
+    with _lock:
+        _cache[key] = score
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Not fork, for the same reason as images.process_later().
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=_load_analyzer,
+                                    mp_context=multiprocessing.get_context("forkserver"))
+    return _pool
+
+
+def polarity(text):
+    """Returns the polarity of `text`, from -1.0 (negative) to 1.0 (positive)."""
+    return polarities([text])[0]
+
+
+def polarities(texts):
+    """
+    Scores many texts at once, e.g. for bulk imports or re-moderation sweeps.
+    Returns the polarities in the same order as `texts`.
+    """
+    normalized = [_normalize(text or "") for text in texts]
+    keys = [_key(text) for text in normalized]
+    scores = [_cached(key) for key in keys]
+
+    missing = {}
+    for i, score in enumerate(scores):
+        if score is None and normalized[i]:
+            missing.setdefault(normalized[i], []).append(i)
+        elif score is None:
+            scores[i] = 0.0
+
+    if missing:
+        todo = list(missing)
+        if len(todo) < POOL_MIN:
+            results = _score_many(todo)
+        else:
+            chunks = [todo[i:i + BATCH_CHUNK] for i in range(0, len(todo), BATCH_CHUNK)]
+            results = []
+            for chunk_scores in _get_pool().map(_score_many, chunks):
+                results.extend(chunk_scores)
+        for text, score in zip(todo, results):
+            _remember(_key(text), score)
+            for i in missing[text]:
+                scores[i] = score
+    return scores
+
+
+def ensure_corpora():
+    """Downloads the TextBlob corpora if they are missing. Needs network access."""
+    import nltk
+    try:
+        nltk.data.find('corpora/movie_reviews')
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        import textblob.download_corpora
+        textblob.download_corpora.main()
+
+
+def warm_up():
+    """Deploy-time step: fetch the corpora and check that the lexicon loads."""
+    ensure_corpora()
+    _load_analyzer()
+
+
+def is_positive(text):
+    """True if `text` is neutral or positive enough to publish."""
+    if not text:
+        return True
+    return polarity(text) >= THRESHOLD
@@ -0,0 +1,164 @@
+"""
+Blob storage for uploads.
+
+LocalStorage keeps blobs in a directory (UPLOAD_FOLDER); S3Storage keeps them
+in an S3-compatible bucket (AWS, MinIO, R2, ...), so web nodes don't need a
+shared disk. Both take finished files from a spool directory with
+put_file(), which replaces any existing blob atomically.
+
+Pick the backend with environment variables: S3_BUCKET (plus optional
+S3_ENDPOINT_URL, S3_PREFIX and S3_PUBLIC_URL) selects S3, anything else the
+local folder. boto3 is only needed, and only imported, for S3.
+"""
+import mimetypes
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class LocalStorage:
+    def __init__(self, folder):
+        self.folder = folder
+        # Inside the upload folder so put_file() can hard-link instead of copy.
+        self.spool_dir = os.path.join(folder, ".incoming")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def put_file(self, name, path):
+        dest = self._path(name)
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+
+    def open(self, name):
+        """Returns (binary file object, modified time). Raises FileNotFoundError."""
+        path = self._path(name)
+        return open(path, "rb"), os.path.getmtime(path)
+
+    @contextmanager
+    def local_copy(self, name):
+        yield self._path(name)
+
+    def scan(self):
+        """Yields (name, modified time) for every stored file."""
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    yield entry.name, entry.stat().st_mtime
+
+    def delete(self, names):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def public_url(self, name):
+        return None
+
+
+class S3Storage:
+    def __init__(self, bucket, prefix="", endpoint_url=None, public_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.public_base = public_url.rstrip("/") if public_url else None
+        self.spool_dir = tempfile.gettempdir()
+        self._client = None
+
+    def __getstate__(self):
+        # Sent to the image worker processes; each makes its own client.
+        state = self.__dict__.copy()
+        state["_client"] = None
+        return state
+
+    def _s3(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def _missing(self, error):
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def exists(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            self._s3().head_object(Bucket=self.bucket, Key=self._key(name))
+            return True
+        except ClientError as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def put_file(self, name, path):
+        # upload_file streams from disk, switching to multipart for big files.
+        self._s3().upload_file(path, self.bucket, self._key(name),
+                               ExtraArgs={"ContentType": content_type(name)})
+
+    def open(self, name):
+        """Returns (streaming body, modified time). Raises FileNotFoundError."""
+        from botocore.exceptions import ClientError
+        try:
+            obj = self._s3().get_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(name)
+            raise
+        return obj["Body"], obj["LastModified"].timestamp()
+
+    @contextmanager
+    def local_copy(self, name):
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=os.path.splitext(name)[1])
+        os.close(fd)
+        try:
+            self._s3().download_file(self.bucket, self._key(name), path)
+            yield path
+        finally:
+            os.remove(path)
+
+    def scan(self):
+        """Yields (name, modified time) for every object under the prefix."""
+        pages = self._s3().get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix)
+        for page in pages:
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):], obj["LastModified"].timestamp()
+
+    def delete(self, names):
+        names = list(names)
+        for i in range(0, len(names), 1000):
+            self._s3().delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": self._key(name)} for name in names[i:i + 1000]],
+                "Quiet": True,
+            })
+
+    def public_url(self, name):
+        """The blob's URL on a public bucket or CDN, if S3_PUBLIC_URL is set."""
+        if not self.public_base:
+            return None
+        return f"{self.public_base}/{self._key(name)}"
+
+
+def from_env(upload_folder):
+    bucket = os.environ.get("S3_BUCKET")
+    if bucket:
+        return S3Storage(bucket, os.environ.get("S3_PREFIX", ""), os.environ.get("S3_ENDPOINT_URL"),
+                         os.environ.get("S3_PUBLIC_URL"))
+    return LocalStorage(upload_folder)
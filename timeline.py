@@ -0,0 +1,58 @@
+"""
+Fan-out-on-write home timelines for the Following feed.
+
+`home_timeline` holds one row per (follower, post) keyed by
+(user_id, timestamp, post_id), so a feed page is a single range read on the
+primary key instead of a join and sort over every followed author's posts.
+"""
+from pagination import keyset_page
+
+# Posts copied into a timeline when someone follows an author. Older posts
+# by that author are still on their profile.
+BACKFILL_LIMIT = 500
+
+
+def push_post(db, post_id, author_id):
+    """Fans a new post out to every follower of its author."""
+    db.execute("""
+        INSERT OR IGNORE INTO home_timeline (user_id, timestamp, post_id)
+        SELECT follows.follower_id, posts.timestamp, posts.id
+        FROM follows JOIN posts ON posts.id = ?
+        WHERE follows.followed_id = ?
+    """, (post_id, author_id))
+
+
+def backfill(db, follower_id, followed_id, limit=BACKFILL_LIMIT):
+    """Copies the author's most recent posts into the follower's timeline."""
+    db.execute("""
+        INSERT OR IGNORE INTO home_timeline (user_id, timestamp, post_id)
+        SELECT ?, timestamp, id FROM posts
+        WHERE user_id = ? AND deleted_at IS NULL
+        ORDER BY timestamp DESC
+        LIMIT ?
+    """, (follower_id, followed_id, limit))
+
+
+def prune(db, follower_id, followed_id):
+    """Removes an unfollowed author's posts from the follower's timeline."""
+    db.execute("""
+        DELETE FROM home_timeline
+        WHERE user_id = ? AND post_id IN (SELECT id FROM posts WHERE user_id = ?)
+    """, (follower_id, followed_id))
+
+
+def remove_post(db, post_id):
+    db.execute("DELETE FROM home_timeline WHERE post_id = ?", (post_id,))
+
+
+def page(db, user_id, before=None, limit=20):
+    """
+    Returns (rows, next_cursor) for one page of `user_id`'s timeline, newest
+    first. Rows carry only the post id (`timeline_id`) and its sort key; the
+    posts themselves are loaded by hydration.load().
+    """
+    return keyset_page(db, """
+        SELECT timestamp AS timeline_ts, post_id AS timeline_id
+        FROM home_timeline
+        WHERE user_id = ?
+    """, (user_id,), ("timeline_ts", "timeline_id"), before, limit)
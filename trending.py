@@ -0,0 +1,137 @@
+"""
+Time-decayed "hot" ranking for /top?sort=hot.
+
+Every new reaction adds 1 to its post's score, and scores halve every
+HALF_LIFE_HOURS. Reactions are bucketed by the hour they land in, so all
+reactions within one hour weigh the same.
+
+Decaying every row as the clock moves would mean rewriting the whole table.
+Instead `post_trending.score` holds log2 of what the score would be if
+decay ran backwards to the Unix epoch: a reaction in hour h adds
+2 ** (h / HALF_LIFE_HOURS). Decay scales every post by the same factor, so
+the order never changes and a stored score never goes stale. The page is
+read straight off the index in O(page size), and keyset cursors stay
+valid across hours. Keeping the log keeps the numbers small.
+
+age(), run hourly by a background thread, forgets posts whose current
+score has sunk below MIN_SCORE, so the table only holds what is trending.
+"""
+import math
+import sqlite3
+import threading
+import time
+
+import db_pool
+from pagination import keyset_page
+
+HALF_LIFE_HOURS = 6
+# One reaction decays below this in about a day.
+MIN_SCORE = 0.05
+AGE_INTERVAL = 3600
+
+
+def _hour(now=None):
+    return int((time.time() if now is None else now) // 3600)
+
+
+def _floor(now=None):
+    """Stored scores below this have decayed under MIN_SCORE."""
+    return math.log2(MIN_SCORE) + _hour(now) / HALF_LIFE_HOURS
+
+
+def _log_add(a, b):
+    """log2(2**a + 2**b) without overflowing."""
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def record(db, post_id, now=None):
+    """Adds a new reaction to `post_id`'s score. Runs inside the caller's (the writer's) transaction."""
+    weight = _hour(now) / HALF_LIFE_HOURS
+    row = db.execute("SELECT score FROM post_trending WHERE post_id = ?", (post_id,)).fetchone()
+    score = _log_add(row[0], weight) if row else weight
+    db.execute("INSERT OR REPLACE INTO post_trending (post_id, score) VALUES (?, ?)", (post_id, score))
+
+
+def remove_post(db, post_id):
+    """Drops a deleted post. Runs inside the caller's transaction."""
+    db.execute("DELETE FROM post_trending WHERE post_id = ?", (post_id,))
+
+
+def page(db, before=None, limit=20, now=None):
+    """
+    Returns (rows, next_cursor) for one page of the hottest posts; each
+    row's `hot_post_id` is a post id, for hydration.load().
+    """
+    return keyset_page(db, """
+        SELECT score AS hot_score, post_id AS hot_post_id FROM post_trending WHERE score >= ?
+    """, (_floor(now),), ("hot_score", "hot_post_id"), before, limit)
+
+
+def age(db, now=None):
+    """Forgets posts that have cooled below MIN_SCORE. Returns how many."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        removed = db.execute("DELETE FROM post_trending WHERE score < ?", (_floor(now),)).rowcount
+        db.execute("INSERT OR REPLACE INTO trending_meta (id, aged_at) VALUES (1, ?)", (time.time(),))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return removed
+
+
+def rebuild(db, now=None):
+    """
+    Rebuilds every score from the posts. Reaction times aren't stored, so
+    each post's smiles are counted at the hour it was posted; only posts
+    that would still be above MIN_SCORE are kept.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute("DELETE FROM post_trending")
+        most = db.execute("SELECT MAX(smiles) FROM posts WHERE deleted_at IS NULL").fetchone()[0] or 0
+        if most > 0:
+            # Older than this, even the most-smiled post has cooled off.
+            oldest_hour = math.floor((_floor(now) - math.log2(most)) * HALF_LIFE_HOURS)
+            rows = db.execute("""
+                SELECT id, smiles, CAST(strftime('%s', timestamp) AS INTEGER) / 3600 AS hour FROM posts
+                WHERE timestamp >= datetime(?, 'unixepoch') AND smiles > 0 AND deleted_at IS NULL
+            """, (oldest_hour * 3600,)).fetchall()
+            floor = _floor(now)
+            scores = [(post_id, math.log2(smiles) + hour / HALF_LIFE_HOURS) for post_id, smiles, hour in rows]
+            db.executemany("INSERT INTO post_trending (post_id, score) VALUES (?, ?)",
+                           [entry for entry in scores if entry[1] >= floor])
+        db.execute("INSERT OR REPLACE INTO trending_meta (id, aged_at) VALUES (1, ?)", (time.time(),))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def ensure_built(db):
+    """Builds the scores if they never have been, so an upgraded database doesn't start with an empty hot list. Run at startup."""
+    if db.execute("SELECT 1 FROM trending_meta WHERE id = 1").fetchone() is None:
+        rebuild(db)
+
+
+_ager = None
+
+
+def start_ager(db_path):
+    """Starts the background thread that runs age() every AGE_INTERVAL. Safe to call more than once."""
+    global _ager
+    if _ager is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(AGE_INTERVAL)
+            try:
+                with db_pool.connection(db_path) as db:
+                    age(db)
+            except sqlite3.Error as e:
+                print(f"Error aging trending scores: {e}")
+
+    _ager = threading.Thread(target=run, name="trending-ager", daemon=True)
+    _ager.start()
@@ -0,0 +1,195 @@
+"""
+Content-addressed uploads with reference counting.
+
+receive() streams an upload to the storage's spool directory in chunks,
+hashing it as it goes and giving up past MAX_UPLOAD_BYTES. The blob is
+named after its SHA-256, so the same image uploaded twice is stored once.
+`blobs` counts the posts and profiles that use each blob: acquire() and
+release() run inside the writer's transaction next to the row that gains or
+loses the reference.
+
+A blob whose count drops to zero is kept for GRACE seconds, then sweep()
+deletes it with its resized derivatives. It deletes the rows and commits
+first, and only then the files, so slow storage (S3) never holds the write
+lock. A new reference that commits before the sweep has the blob skipped.
+One that commits after it is rechecked just before the files go, and any
+such file is kept. A reference that slips in after the recheck while
+confirm() still sees the file is the one case this misses. A file whose
+delete fails is left for sweep_orphans().
+
+sweep_orphans() catches files no row knows about at all: uploads from before
+reference counting whose posts were deleted, and files left behind by a
+request or image worker that died before committing.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+GRACE = 3600
+SWEEP_BATCH = 100
+
+URL_PREFIX = "/uploads/"
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class Upload:
+    def __init__(self, name, spool_path, size):
+        self.name = name
+        self.spool_path = spool_path
+        self.size = size
+        # True if this request had to put the blob (it was new).
+        self.stored = False
+
+    @property
+    def url(self):
+        return URL_PREFIX + self.name
+
+
+def blob_name(url):
+    """The blob behind an image URL, or None for emoji avatars and external links."""
+    if url and url.startswith(URL_PREFIX):
+        return url[len(URL_PREFIX):]
+    return None
+
+
+def receive(storage, stream, ext):
+    """Streams `stream` into the spool and returns an Upload. Raises UploadTooLarge."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=storage.spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"uploads are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                digest.update(chunk)
+                spool.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return Upload(f"{digest.hexdigest()}.{ext}", path, size)
+
+
+def store(storage, upload):
+    """Puts the blob unless an identical one is already stored."""
+    if not storage.exists(upload.name):
+        storage.put_file(upload.name, upload.spool_path)
+        upload.stored = True
+
+
+def confirm(storage, upload):
+    """
+    Called once the row referencing the upload has committed: makes sure a
+    sweep didn't remove the blob in between, and drops the spool file.
+    Returns True if the blob had to be stored again.
+    """
+    try:
+        if storage.exists(upload.name):
+            return False
+        storage.put_file(upload.name, upload.spool_path)
+        return True
+    finally:
+        os.remove(upload.spool_path)
+
+
+def discard(upload):
+    """Drops the spool file of an upload that won't be used."""
+    if os.path.exists(upload.spool_path):
+        os.remove(upload.spool_path)
+
+
+def acquire(db, url):
+    name = blob_name(url)
+    if name:
+        db.execute("""
+            INSERT INTO blobs (name, refs, released_at) VALUES (?, 1, NULL)
+            ON CONFLICT (name) DO UPDATE SET refs = refs + 1, released_at = NULL
+        """, (name,))
+
+
+def release(db, url):
+    name = blob_name(url)
+    if name:
+        db.execute("""
+            UPDATE blobs SET refs = refs - 1, released_at = CASE WHEN refs <= 1 THEN ? END
+            WHERE name = ?
+        """, (time.time(), name))
+
+
+def transfer(db, old_url, new_url, refs):
+    """
+    Moves `refs` references from one blob to another, for rows repointed in
+    bulk. The new blob is registered even with no references, so it is swept
+    in time. Runs inside the caller's transaction.
+    """
+    old, new = blob_name(old_url), blob_name(new_url)
+    now = time.time()
+    db.execute("INSERT INTO blobs (name, refs, released_at) VALUES (?, 0, ?) ON CONFLICT (name) DO NOTHING",
+               (new, now))
+    if refs:
+        db.execute("UPDATE blobs SET refs = refs + ?, released_at = NULL WHERE name = ?", (refs, new))
+        db.execute("""
+            UPDATE blobs SET refs = refs - ?, released_at = CASE WHEN refs <= ? THEN ? END
+            WHERE name = ?
+        """, (refs, refs, now, old))
+
+
+def sweep(db, storage, grace=GRACE):
+    """
+    Deletes up to SWEEP_BATCH blobs that have been unreferenced for `grace`
+    seconds, along with their derivatives. Returns how many were deleted.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        names = [row[0] for row in db.execute("""
+            SELECT name FROM blobs WHERE refs <= 0 AND released_at < ? LIMIT ?
+        """, (time.time() - grace, SWEEP_BATCH))]
+        if not names:
+            db.rollback()
+            return 0
+
+        urls = [URL_PREFIX + name for name in names]
+        placeholders = ",".join("?" * len(urls))
+        derivatives = [blob_name(row[0]) for row in db.execute(
+            f"SELECT path FROM image_derivatives WHERE image IN ({placeholders})", urls)]
+
+        db.execute(f"DELETE FROM image_derivatives WHERE image IN ({placeholders})", urls)
+        db.execute(f"DELETE FROM processed_uploads WHERE processed IN ({placeholders})", names)
+        db.execute(f"DELETE FROM blobs WHERE name IN ({placeholders})", names)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # Derivatives are named after their content, so another image may share
+    # one, and a blob may have been uploaded again since the commit.
+    files = sorted(set(names + derivatives))
+    placeholders = ",".join("?" * len(files))
+    in_use = {row[0] for row in db.execute(f"SELECT name FROM blobs WHERE name IN ({placeholders})", files)}
+    in_use.update(blob_name(row[0]) for row in db.execute(
+        f"SELECT path FROM image_derivatives WHERE path IN ({placeholders})", [URL_PREFIX + name for name in files]))
+    storage.delete([name for name in files if name not in in_use])
+    return len(names)
+
+
+def sweep_orphans(db, storage, grace=GRACE):
+    """
+    Deletes stored files older than `grace` seconds that are neither a blob
+    nor a derivative of one. Returns how many were deleted.
+    """
+    known = {row[0] for row in db.execute("SELECT name FROM blobs")}
+    known.update(blob_name(row[0]) for row in db.execute("SELECT path FROM image_derivatives"))
+    cutoff = time.time() - grace
+    orphans = [name for name, modified_at in storage.scan() if name not in known and modified_at < cutoff]
+    storage.delete(orphans)
+    return len(orphans)
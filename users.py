@@ -0,0 +1,71 @@
+"""
+In-process cache of user rows.
+
+current_user() and the post lists' author fields read from here instead of
+querying `users` on every request. Entries expire after TTL seconds and the
+least recently used ones are dropped beyond CACHE_SIZE. Writers to `users`
+call invalidate(); other processes pick the change up once the TTL runs out.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import dal
+
+TTL = 60
+CACHE_SIZE = 10000
+
+_cache = OrderedDict()  # user id -> (expires_at, row as a dict)
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def _cached(user_id, now):
+    entry = _cache.get(user_id)
+    if entry is None or entry[0] < now:
+        return None
+    _cache.move_to_end(user_id)
+    return entry[1]
+
+
+def get_many(db, user_ids):
+    """Returns {id: user} for the given ids, fetching the misses in one query."""
+    global hits, misses
+    now = time.monotonic()
+    found = {}
+    with _lock:
+        for user_id in set(user_ids):
+            user = _cached(user_id, now)
+            if user is not None:
+                found[user_id] = user
+        missing = [user_id for user_id in set(user_ids) if user_id not in found]
+        hits += len(found)
+        misses += len(missing)
+
+    if missing:
+        rows = dal.get(db).users_by_id(db, missing)
+        with _lock:
+            for user in rows:
+                found[user["id"]] = user
+                _cache[user["id"]] = (now + TTL, user)
+                _cache.move_to_end(user["id"])
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return found
+
+
+def get(db, user_id):
+    """Returns the user with `user_id` as a dict, or None."""
+    return get_many(db, [user_id]).get(user_id)
+
+
+def invalidate(user_id):
+    """Drops `user_id` after its row changed (profile edit, password reset, ...)."""
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def stats():
+    with _lock:
+        return {"size": len(_cache), "hits": hits, "misses": misses}
@@ -0,0 +1,153 @@
+"""
+Single-writer queue for SQLite mutations.
+
+Request threads hand a mutation to the process's writer thread and block
+until it has been committed. The writer collects whatever arrives within
+BATCH_WINDOW (up to MAX_BATCH) and applies it in one transaction, each
+mutation under its own savepoint so one failure doesn't sink the batch.
+One writer per process means one lock holder and one fsync per batch instead
+of a lock fight and an fsync per request.
+
+A queued write is never given up on: submit() waits for its outcome, since
+a write that timed out could still commit afterwards. If the writer thread
+itself dies, everything it had not applied fails with WriterStopped, and
+the next submit() starts a new writer.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import db_pool
+
+BATCH_WINDOW = 0.002
+MAX_BATCH = 256
+# How often a waiting submit() checks that the writer thread is still alive.
+LIVENESS_CHECK = 1
+
+
+class WriterStopped(RuntimeError):
+    """The writer thread died before applying the write; nothing was committed."""
+
+
+class Writer:
+    def __init__(self, path):
+        self.path = path
+        self.batches = 0
+        self.mutations = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def submit(self, op, *args):
+        """
+        Runs `op(db, *args)` in the next batch and returns its result once the
+        batch has committed. Exceptions raised by `op` are re-raised here;
+        WriterStopped means the write was not applied.
+        """
+        future = Future()
+        self._queue.put((op, args, future))
+        while True:
+            try:
+                return future.result(LIVENESS_CHECK)
+            except TimeoutError:
+                # A write that arrived after the thread drained its queue.
+                if not self.alive and not future.done():
+                    raise WriterStopped("the database writer has stopped")
+
+    def _run(self):
+        batch = []
+        try:
+            with db_pool.connection(self.path) as db:
+                # Acknowledged writes must survive power loss, not just a
+                # crash; the fsync is shared by the whole batch.
+                db.execute("PRAGMA synchronous = FULL")
+                try:
+                    while True:
+                        batch = [self._queue.get()]
+                        deadline = time.monotonic() + BATCH_WINDOW
+                        while len(batch) < MAX_BATCH:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            try:
+                                batch.append(self._queue.get(timeout=remaining))
+                            except queue.Empty:
+                                break
+                        self._apply(db, batch)
+                        batch = []
+                finally:
+                    if db.in_transaction:
+                        db.rollback()
+                    db.execute("PRAGMA synchronous = NORMAL")
+        except Exception as e:
+            print(f"Database writer stopped: {e}")
+            self._fail(batch, WriterStopped(f"the database writer has stopped: {e}"))
+
+    def _fail(self, batch, error):
+        """Fails the writes the dead thread had taken or that are still queued."""
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _apply(self, db, batch):
+        outcomes = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for op, args, future in batch:
+                db.execute("SAVEPOINT mutation")
+                try:
+                    outcomes.append((future, op(db, *args), None))
+                    db.execute("RELEASE mutation")
+                except Exception as e:
+                    db.execute("ROLLBACK TO mutation")
+                    db.execute("RELEASE mutation")
+                    outcomes.append((future, None, e))
+            db.commit()
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.mutations += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path):
+    """The writer for `path`, started on first use and again if its thread has died."""
+    with _writers_lock:
+        if path not in _writers or not _writers[path].alive:
+            _writers[path] = Writer(path)
+        return _writers[path]
+
+
+def submit(path, op, *args):
+    """Runs `op(db, *args)` on `path`'s writer and returns its committed result."""
+    return get_writer(path).submit(op, *args)
+
+
+def stats():
+    with _writers_lock:
+        writers = dict(_writers)
+    return {path: {"batches": w.batches, "mutations": w.mutations, "queued": w._queue.qsize(), "alive": w.alive}
+            for path, w in writers.items()}